@@ -0,0 +1,392 @@
+import os
+import sys
+import time
+import tempfile
+import statistics
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+sys.path.append("./")
+from x2_gaussian.arguments import ModelHiddenParams, OptimizationParams, PipelineParams
+from x2_gaussian.gaussian import GaussianModel, query
+from x2_gaussian.gaussian.hexplane import HexPlaneField, interpolate_ms_features, normalize_aabb
+from x2_gaussian.gaussian.hashgrid import HashGridField
+from x2_gaussian.gaussian.knn import distCUDA2, cpu_mean_knn_dist2
+from x2_gaussian.gaussian.spatial_index import SpatialIndex
+from x2_gaussian.utils.image_utils import metric_vol
+
+
+def time_it(fn, device, repeat):
+    """Median wall time of fn() in milliseconds, after one warm-up call."""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def make_gaussians(hyper, num_points):
+    """Random Gaussians inside the deformation field bounds."""
+    gaussians = GaussianModel(None, hyper)
+    xyz = (np.random.rand(num_points, 3) * 2 - 1) * hyper.bounds * 0.5
+    gaussians.create_from_pcd(xyz, np.full((num_points, 1), 0.5), 1.0)
+    gaussians.deform_cache_bytes = 0  # time the network, not the cache
+    return gaussians
+
+
+def bench_hexplane(args, hyper, device):
+    """Per-plane vs fused (one grid_sample per plane shape) HexPlane sampling."""
+    field = HexPlaneField(hyper.bounds, hyper.kplanes_config, hyper.multires).to(device)
+    grid_dimensions = field.grid_config[0]["grid_dimensions"]
+    print(f"{'points':>9} {'time':>7} {'pass':>9} {'per-plane ms':>13} {'fused ms':>9}")
+    for num_points in args.num_points:
+        pts = normalize_aabb(
+            (torch.rand(num_points, 3, device=device) * 2 - 1) * hyper.bounds, field.aabb
+        )
+        timestamp = torch.full((num_points, 1), 0.37, device=device)
+        inputs = {
+            "point": (torch.cat((pts, timestamp), -1), None),
+            "scalar": (pts, timestamp[0, 0]),
+        }
+        for time_mode, (coords, scalar_time) in inputs.items():
+            for backward in [False, True]:
+                def run(fuse):
+                    with torch.set_grad_enabled(backward):
+                        features = interpolate_ms_features(
+                            coords, ms_grids=field.grids, grid_dimensions=grid_dimensions,
+                            concat_features=field.concat_features, num_levels=None,
+                            timestamp=scalar_time, fuse_planes=fuse)
+                        if backward:
+                            features.sum().backward()
+                ms = [time_it(lambda: run(fuse), device, args.repeat) for fuse in [False, True]]
+                pass_name = "fwd+bwd" if backward else "fwd"
+                print(f"{num_points:>9} {time_mode:>7} {pass_name:>9} {ms[0]:>13.1f} {ms[1]:>9.1f}")
+
+
+def bench_static(args, hyper, device):
+    """Deformation time vs fraction of Gaussians marked static in _deformation_table."""
+    print(f"{'points':>9} {'static':>7} {'fwd ms':>8} {'speedup':>8} {'fwd+bwd ms':>11} {'speedup':>8}")
+    for num_points in args.num_points:
+        gaussians = make_gaussians(hyper, num_points)
+
+        def run(backward):
+            with torch.set_grad_enabled(backward):
+                deformed = gaussians.get_deformed(0.37)
+                if backward:
+                    sum(value.sum() for value in deformed).backward()
+
+        baseline = None
+        for fraction in args.static_fractions:
+            gaussians._deformation_table = torch.rand(num_points, device=gaussians.get_xyz.device) >= fraction
+            ms = [time_it(lambda: run(backward), device, args.repeat) for backward in [False, True]]
+            baseline = baseline or ms
+            print(f"{num_points:>9} {fraction:>7.2f} {ms[0]:>8.1f} {baseline[0] / ms[0]:>7.2f}x "
+                  f"{ms[1]:>11.1f} {baseline[1] / ms[1]:>7.2f}x")
+
+
+def bench_compile(args, hyper, device):
+    """Eager vs torch.compile'd deformation network, with dynamic shapes and bucketed padding."""
+    bucket_size = args.compile_bucket or 16384
+    modes = {"eager": (False, 0), "dynamic": (True, 0), "bucket": (True, bucket_size)}
+    print(f"{'mode':>8} {'points':>9} {'1st call ms':>12} {'fwd ms':>8} {'fwd+bwd ms':>11}")
+    for mode, (compiled, bucket) in modes.items():
+        torch._dynamo.reset()
+        hyper.compile_deformation, hyper.compile_bucket = compiled, bucket
+        torch.manual_seed(0)
+        np.random.seed(0)
+        gaussians = make_gaussians(hyper, max(args.num_points))
+        for num_points in args.num_points:
+            # Vary N on one model, as densification does, so recompilation shows in the first call
+            gaussians._deformation_table = torch.arange(max(args.num_points), device=device) < num_points
+
+            def run(backward):
+                with torch.set_grad_enabled(backward):
+                    deformed = gaussians.get_deformed(0.37)
+                    if backward:
+                        sum(value.sum() for value in deformed).backward()
+
+            start = time.perf_counter()
+            run(True)
+            first_ms = (time.perf_counter() - start) * 1000
+            ms = [time_it(lambda: run(backward), device, args.repeat) for backward in [False, True]]
+            print(f"{mode:>8} {num_points:>9} {first_ms:>12.1f} {ms[0]:>8.1f} {ms[1]:>11.1f}")
+
+
+def bench_encoder(args, hyper, device):
+    """Parameter memory and sampling speed of HexPlaneField vs HashGridField."""
+    fields = {
+        "hexplane": HexPlaneField(hyper.bounds, hyper.kplanes_config, hyper.multires).to(device),
+        "hash": HashGridField(hyper.bounds, hyper.kplanes_config, hyper.multires).to(device),
+    }
+    print(f"{'encoder':>9} {'feat_dim':>8} {'params MB':>10} {'w/ Adam MB':>11}")
+    for name, field in fields.items():
+        nbytes = sum(p.numel() * p.element_size() for p in field.parameters() if p.requires_grad)
+        print(f"{name:>9} {field.feat_dim:>8} {nbytes / 2**20:>10.1f} {3 * nbytes / 2**20:>11.1f}")
+
+    print(f"{'encoder':>9} {'points':>9} {'fwd ms':>8} {'fwd+bwd ms':>11}")
+    for num_points in args.num_points:
+        pts = (torch.rand(num_points, 3, device=device) * 2 - 1) * hyper.bounds
+        timestamp = torch.tensor(0.37, device=device)
+        for name, field in fields.items():
+            def run(backward):
+                with torch.set_grad_enabled(backward):
+                    features = field(pts, timestamp)
+                    if backward:
+                        features.sum().backward()
+            ms = [time_it(lambda: run(backward), device, args.repeat) for backward in [False, True]]
+            print(f"{name:>9} {num_points:>9} {ms[0]:>8.1f} {ms[1]:>11.1f}")
+
+
+def bench_quantize(args, hyper, device):
+    """deformation.pth size and phase-volume fidelity of fp16/int8 planes against fp32."""
+    gaussians = make_gaussians(hyper, args.num_points[0])
+    if args.model_path:
+        gaussians.load_ply(os.path.join(args.model_path, "point_cloud.pickle"))
+        gaussians.load_model(args.model_path)
+    nVoxel, sVoxel = [args.num_voxels] * 3, [hyper.bounds] * 3
+    # Mid-phase times of the ten breathing phases, as in training_report
+    times = [(0.15 + 0.3 * t) / 60.0 for t in range(10)]
+
+    def phase_volumes():
+        with torch.no_grad():
+            return [query(gaussians, [0, 0, 0], nVoxel, sVoxel, args.pipe, time)["vol"] for time in times]
+
+    reference = phase_volumes()
+    print(f"{'format':>7} {'deformation.pth MB':>19} {'psnr_3d':>8} {'ssim_3d':>8}")
+    for fmt in ["fp32", "fp16", "int8"]:
+        with tempfile.TemporaryDirectory() as path:
+            gaussians.plane_format = fmt
+            gaussians.save_deformation(path)
+            size = os.path.getsize(os.path.join(path, "deformation.pth")) / 2**20
+            gaussians.load_model(path)
+        volumes = phase_volumes()
+        # metric_vol takes its first volume as GT; fp32 planes are the reference here
+        psnr = np.mean([metric_vol(ref, vol, "psnr", pixel_max=None)[0] for ref, vol in zip(reference, volumes)])
+        ssim = np.mean([metric_vol(ref, vol, "ssim")[0] for ref, vol in zip(reference, volumes)])
+        print(f"{fmt:>7} {size:>19.1f} {psnr:>8.2f} {ssim:>8.4f}")
+
+
+def bench_regulation(args, hyper, device):
+    """Three-pass vs fused compute_regulation per fine-stage iteration, for regulation_interval k."""
+    gaussians = make_gaussians(hyper, 1000)
+    weights = (hyper.time_smoothness_weight, hyper.l1_time_planes, hyper.plane_tv_weight)
+
+    def three_pass():
+        return (hyper.plane_tv_weight * gaussians._plane_regulation()
+                + hyper.time_smoothness_weight * gaussians._time_regulation()
+                + hyper.l1_time_planes * gaussians._l1_regulation())
+
+    def run(regulation):
+        regulation().backward()
+        gaussians._deformation.zero_grad(set_to_none=True)
+
+    ms = {name: time_it(lambda: run(fn), device, args.repeat)
+          for name, fn in [("three-pass", three_pass), ("fused", lambda: gaussians.compute_regulation(*weights))]}
+    print(f"{'regularizer':>11} {'k':>3} {'fwd+bwd ms/it':>14} {'speedup':>8}")
+    for name, value in ms.items():
+        for k in [1, 4, 16]:
+            print(f"{name:>11} {k:>3} {value / k:>14.1f} {ms['three-pass'] * k / value:>7.2f}x")
+
+
+def bench_sparse_adam(args, hyper, device):
+    """optimizer.step() time with dense Adam vs SparseRowAdam on the grid param group."""
+    print(f"{'points':>9} {'regularizer':>11} {'Adam ms':>8} {'sparse ms':>10} {'speedup':>8} {'rows updated':>13}")
+    for num_points in args.num_points:
+        gaussians = make_gaussians(hyper, num_points)
+        for regularize in [False, True]:
+            ms = []
+            for sparse in [False, True]:
+                args.opt.grid_sparse_adam = sparse
+                gaussians.training_setup(args.opt)
+
+                def backward():
+                    deformed = gaussians.get_deformed(float(torch.rand(())))
+                    loss = sum(value.sum() for value in deformed)
+                    if regularize:
+                        loss = loss + gaussians.compute_regulation(
+                            hyper.time_smoothness_weight, hyper.l1_time_planes, hyper.plane_tv_weight)
+                    loss.backward()
+
+                timings = []
+                for _ in range(args.repeat + 1):
+                    backward()
+                    start = time.perf_counter()
+                    gaussians.optimizer.step()
+                    timings.append((time.perf_counter() - start) * 1000)
+                    gaussians.optimizer.zero_grad(set_to_none=False)
+                ms.append(statistics.median(timings[1:]))
+            planes = gaussians._deformation.get_grid_parameters()
+            rows = sum(int(gaussians.optimizer.state[p]["last_step"].eq(args.repeat + 1).sum()) for p in planes if p.requires_grad)
+            total = sum(p.shape[2] for p in planes if p.requires_grad)
+            print(f"{num_points:>9} {str(regularize):>11} {ms[0]:>8.1f} {ms[1]:>10.1f} {ms[0] / ms[1]:>7.2f}x {rows / total:>12.1%}")
+
+
+def bench_densify(args, hyper, device):
+    """Clone and prune cycles at a steady number of Gaussians, through RowStorage."""
+    print(f"{'points':>9} {'ms/cycle':>9} {'reallocations':>14} {'capacity':>9}")
+    for num_points in args.num_points:
+        gaussians = make_gaussians(hyper, num_points)
+        gaussians.training_setup(args.opt)
+        (gaussians._xyz.sum() + gaussians._density.sum() + gaussians._scaling.sum()
+         + gaussians._rotation.sum()).backward()
+        gaussians.optimizer.step()  # with Adam moments to move along
+
+        def cycle():
+            # Clone and prune about 1% each
+            grads = torch.rand(gaussians.get_xyz.shape[0], 1, device=device)
+            with torch.no_grad():
+                gaussians.densify_and_clone(grads, 0.99, float("inf"))
+                gaussians.prune_points(torch.rand(gaussians.get_xyz.shape[0], device=device) < 0.01)
+
+        gaussians.storage.num_reallocations = 0
+        ms = time_it(cycle, device, args.repeat)
+        print(f"{num_points:>9} {ms:>9.1f} {gaussians.storage.num_reallocations:>14} {gaussians.storage.capacity:>9}")
+
+
+def bench_visible_adam(args, hyper, device):
+    """optimizer.step() time for the per-Gaussian parameters, with dense Adam vs the
+    visibility-masked update of PackedAdam, by share of visible Gaussians."""
+    print(f"{'points':>9} {'visible':>8} {'Adam ms':>8} {'sparse ms':>10} {'speedup':>8}")
+    for num_points in args.num_points:
+        gaussians = make_gaussians(hyper, num_points)
+        for fraction in args.visible_fractions:
+            ms = []
+            for sparse in [False, True]:
+                args.opt.visible_sparse_adam = sparse
+                gaussians.training_setup(args.opt)
+
+                def step():
+                    # Gradient on the visible Gaussians only, as from one rendered projection
+                    visible = torch.rand(num_points, device=device) < fraction
+                    gaussians._packed.grad = torch.randn_like(gaussians._packed) * visible.unsqueeze(1)
+                    if device.type == "cuda":
+                        torch.cuda.synchronize()
+                    start = time.perf_counter()
+                    gaussians.optimizer.step(visible=visible)
+                    if device.type == "cuda":
+                        torch.cuda.synchronize()
+                    return (time.perf_counter() - start) * 1000
+
+                step()
+                ms.append(statistics.median(step() for _ in range(args.repeat)))
+            print(f"{num_points:>9} {fraction:>8.0%} {ms[0]:>8.2f} {ms[1]:>10.2f} {ms[0] / ms[1]:>7.2f}x")
+
+
+def bench_knn(args, hyper, device):
+    """Initial-scale statistic (mean squared distance to the 3 nearest points) on the CPU,
+    checked against distCUDA2 when it is built and a GPU is used."""
+    print(f"{'points':>9} {'CPU ms':>9} {'CUDA ms':>9} {'max rel err':>12}")
+    for num_points in args.num_points:
+        xyz = (torch.rand(num_points, 3) * 2 - 1) * hyper.bounds * 0.5
+        cpu_ms = time_it(lambda: cpu_mean_knn_dist2(xyz), torch.device("cpu"), args.repeat)
+        if distCUDA2 is not None and device.type == "cuda":
+            xyz_cuda = xyz.to(device)
+            cuda_ms = time_it(lambda: distCUDA2(xyz_cuda), device, args.repeat)
+            reference = distCUDA2(xyz_cuda).cpu()
+            error = ((cpu_mean_knn_dist2(xyz) - reference).abs() / reference.clamp_min(1e-12)).max().item()
+            print(f"{num_points:>9} {cpu_ms:>9.1f} {cuda_ms:>9.1f} {error:>12.2e}")
+        else:
+            print(f"{num_points:>9} {cpu_ms:>9.1f} {'-':>9} {'-':>12}")
+
+
+def bench_spatial_index(args, hyper, device):
+    """gaussians_in_box and gaussians_near against a linear scan of all centers."""
+    print(f"{'points':>9} {'build ms':>9} {'box ms':>7} {'scan ms':>8} {'near ms':>8} {'scan ms':>8} {'in box':>7} {'near':>5}")
+    for num_points in args.num_points:
+        gaussians = make_gaussians(hyper, num_points)
+        xyz = gaussians.get_xyz.detach()
+        build_ms = time_it(lambda: SpatialIndex(xyz), device, args.repeat)
+        gaussians.spatial_index  # built once, as after a densification
+        # A box of the 3D TV loss size, 1/10 of the scene per axis, and 64 points with a
+        # radius of 1/50 of the scene
+        extent = float((xyz.max(0).values - xyz.min(0).values).max())
+        bbox = torch.stack([-torch.full((3,), extent / 20), torch.full((3,), extent / 20)]).to(xyz)
+        points = xyz[torch.randint(0, num_points, (64,), device=xyz.device)]
+        radius = extent / 50
+        box_ms = time_it(lambda: gaussians.gaussians_in_box(bbox), device, args.repeat)
+        box_scan_ms = time_it(lambda: ((xyz >= bbox[0]) & (xyz <= bbox[1])).all(1).nonzero(), device, args.repeat)
+        near_ms = time_it(lambda: gaussians.gaussians_near(points, radius), device, args.repeat)
+        near_scan_ms = time_it(
+            lambda: (torch.cdist(xyz, points, compute_mode="donot_use_mm_for_euclid_dist").amin(1) <= radius).nonzero(),
+            device, args.repeat)
+        found = (gaussians.gaussians_in_box(bbox).numel(), gaussians.gaussians_near(points, radius).numel())
+        print(f"{num_points:>9} {build_ms:>9.1f} {box_ms:>7.2f} {box_scan_ms:>8.2f} {near_ms:>8.2f} "
+              f"{near_scan_ms:>8.2f} {found[0]:>7} {found[1]:>5}")
+
+
+def bench_morton(args, hyper, device):
+    """HexPlane sampling and deformation time with the Gaussians in random order vs
+    sorted by sort_by_morton."""
+    print(f"{'points':>9} {'order':>7} {'grid fwd ms':>12} {'grid fwd+bwd ms':>16} {'deform ms':>10} {'sort ms':>8}")
+    for num_points in args.num_points:
+        gaussians = make_gaussians(hyper, num_points)
+        gaussians.training_setup(args.opt)
+        # Random order, as after many densification steps
+        gaussians._sync_storage()
+        gaussians.storage.permute(torch.randperm(num_points, device=gaussians.get_xyz.device))
+        gaussians._publish_storage()
+        grid = gaussians._deformation.deformation_net.grid
+        time_value = torch.tensor(0.37, device=gaussians.get_xyz.device)
+
+        def sample(backward):
+            with torch.set_grad_enabled(backward):
+                features = grid(gaussians.get_xyz.detach(), time_value)
+                if backward:
+                    features.sum().backward()
+
+        for order in ["random", "morton"]:
+            sort_ms = 0.0
+            if order == "morton":
+                start = time.perf_counter()
+                gaussians.sort_by_morton()
+                sort_ms = (time.perf_counter() - start) * 1000
+            ms = [time_it(lambda: sample(backward), device, args.repeat) for backward in [False, True]]
+            ms.append(time_it(lambda: gaussians.get_deformed(0.37), device, args.repeat))
+            print(f"{num_points:>9} {order:>7} {ms[0]:>12.1f} {ms[1]:>16.1f} {ms[2]:>10.1f} {sort_ms:>8.1f}")
+
+
+TASKS = {
+    "hexplane": bench_hexplane,
+    "static": bench_static,
+    "compile": bench_compile,
+    "encoder": bench_encoder,
+    "quantize": bench_quantize,
+    "regulation": bench_regulation,
+    "sparse_adam": bench_sparse_adam,
+    "densify": bench_densify,
+    "visible_adam": bench_visible_adam,
+    "knn": bench_knn,
+    "spatial_index": bench_spatial_index,
+    "morton": bench_morton,
+}
+
+
+if __name__ == "__main__":
+    # fmt: off
+    parser = ArgumentParser(description="Benchmark scripts")
+    hp = ModelHiddenParams(parser)
+    op = OptimizationParams(parser)
+    pp = PipelineParams(parser)
+    parser.add_argument("--task", type=str, default="hexplane", choices=list(TASKS.keys()))
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--num_points", nargs="+", type=int, default=[50_000, 200_000, 1_000_000])
+    parser.add_argument("--static_fractions", nargs="+", type=float, default=[0.0, 0.25, 0.5, 0.75, 0.9])
+    parser.add_argument("--visible_fractions", nargs="+", type=float, default=[0.1, 0.3, 0.5, 0.9])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--model_path", type=str, default="", help="point_cloud/iteration_* folder of a trained model")
+    parser.add_argument("--num_voxels", type=int, default=128)
+    args = parser.parse_args(sys.argv[1:])
+    # fmt: on
+
+    torch.manual_seed(0)
+    np.random.seed(0)
+    args.opt, args.pipe = op.extract(args), pp.extract(args)
+    TASKS[args.task](args, hp.extract(args), torch.device(args.device))
@@ -0,0 +1,117 @@
+import os
+import os.path as osp
+import sys
+import copy
+import shutil
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+sys.path.append("./")
+from x2_gaussian.arguments import ModelParams, PipelineParams, ModelHiddenParams, get_combined_args
+from x2_gaussian.gaussian import GaussianModel, query, initialize_gaussian
+from x2_gaussian.dataset import Scene
+from x2_gaussian.utils.general_utils import safe_state
+from x2_gaussian.utils.image_utils import metric_vol
+from x2_gaussian.utils.system_utils import mkdir_p
+
+
+def phase_volumes(gaussians, scanner_cfg, pipe):
+    """Volumes at the mid-times of the ten breathing phases, as in training_report."""
+    breath_cycle = 3.0
+    num_phases = 10
+    phase_time = breath_cycle / num_phases
+    scanTime = 60.0
+    volumes = []
+    with torch.no_grad():
+        for t in range(num_phases):
+            time = (phase_time / 2 + phase_time * t) / scanTime
+            volumes.append(query(
+                gaussians,
+                scanner_cfg["offOrigin"],
+                scanner_cfg["nVoxel"],
+                scanner_cfg["sVoxel"],
+                pipe,
+                time,
+                "fine",
+            )["vol"])
+    return volumes
+
+
+def mean_metrics(volumes_gt, volumes):
+    psnr = np.mean([metric_vol(gt, vol, "psnr")[0] for gt, vol in zip(volumes_gt, volumes)])
+    ssim = np.mean([metric_vol(gt, vol, "ssim")[0] for gt, vol in zip(volumes_gt, volumes)])
+    return psnr, ssim
+
+
+def distill(dataset, pipe, hyper, args):
+    scene = Scene(dataset, shuffle=False)
+    scanner_cfg = scene.scanner_cfg
+    volume_to_world = max(scanner_cfg["sVoxel"])
+    scale_bound = None
+    if dataset.scale_min > 0 and dataset.scale_max > 0:
+        scale_bound = np.array([dataset.scale_min, dataset.scale_max]) * volume_to_world
+    gaussians = GaussianModel(scale_bound, hyper)
+    loaded_iter = initialize_gaussian(gaussians, dataset, args.iteration)
+    teacher_params = sum(p.numel() for p in gaussians._deformation.parameters())
+
+    student_args = copy.copy(gaussians.deform_args)
+    if args.student_net_width:
+        student_args.net_width = args.student_net_width
+    if args.student_output_coordinate_dim:
+        student_args.kplanes_config = dict(
+            student_args.kplanes_config, output_coordinate_dim=args.student_output_coordinate_dim
+        )
+    if args.student_multires:
+        student_args.multires = args.student_multires
+    student_args.plane_init_scale = 1.0
+
+    teacher_volumes = phase_volumes(gaussians, scanner_cfg, pipe)
+    loss = gaussians.distill_deformation(
+        student_args, iterations=args.distill_iterations, batch_size=args.batch_size
+    )
+    student_params = sum(p.numel() for p in gaussians._deformation.parameters())
+    student_volumes = phase_volumes(gaussians, scanner_cfg, pipe)
+    print(f"Distillation loss {loss:.3e}, parameters {teacher_params} -> {student_params}")
+
+    # Fidelity on the ten phase volumes, against the teacher and the ground truth
+    psnr, ssim = mean_metrics(teacher_volumes, student_volumes)
+    print(f"Student vs teacher: psnr3d {psnr:.3f}, ssim3d {ssim:.3f}")
+    psnr, ssim = mean_metrics(scene.vol_gt, teacher_volumes)
+    print(f"Teacher vs GT: psnr3d {psnr:.3f}, ssim3d {ssim:.3f}")
+    psnr, ssim = mean_metrics(scene.vol_gt, student_volumes)
+    print(f"Student vs GT: psnr3d {psnr:.3f}, ssim3d {ssim:.3f}")
+
+    # Same layout as training output, so the student loads with --model_path output_path
+    point_cloud_path = osp.join(args.output_path, "point_cloud", f"iteration_{loaded_iter}")
+    gaussians.save_ply(osp.join(point_cloud_path, "point_cloud.pickle"))
+    gaussians.save_deformation(point_cloud_path)
+    for name in ["cfg_args", "cfg_args.yml"]:
+        if osp.exists(osp.join(dataset.model_path, name)):
+            shutil.copy(osp.join(dataset.model_path, name), osp.join(args.output_path, name))
+    print(f"Student saved to {point_cloud_path}")
+
+
+if __name__ == "__main__":
+    # fmt: off
+    parser = ArgumentParser(description="Distill the deformation network into a smaller student")
+    lp = ModelParams(parser, sentinel=True)
+    pp = PipelineParams(parser)
+    hp = ModelHiddenParams(parser)
+    parser.add_argument("--iteration", type=int, default=-1)
+    parser.add_argument("--output_path", type=str, default=None)
+    parser.add_argument("--student_net_width", type=int, default=0)
+    parser.add_argument("--student_output_coordinate_dim", type=int, default=0)
+    parser.add_argument("--student_multires", nargs="+", type=int, default=None)
+    parser.add_argument("--distill_iterations", type=int, default=5000)
+    parser.add_argument("--batch_size", type=int, default=16384)
+    parser.add_argument("--quiet", action="store_true")
+    args = get_combined_args(parser)
+    # fmt: on
+    if args.output_path is None:
+        args.output_path = args.model_path.rstrip("/") + "_distilled"
+    mkdir_p(args.output_path)
+
+    safe_state(args.quiet)
+    distill(lp.extract(args), pp.extract(args), hp.extract(args), args)
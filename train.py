@@ -11,7 +11,7 @@ import math
 
 sys.path.append("./")
 from x2_gaussian.arguments import ModelParams, OptimizationParams, PipelineParams, ModelHiddenParams
-from x2_gaussian.gaussian import GaussianModel, render, query, initialize_gaussian, render_prior_oneT
+from x2_gaussian.gaussian import GaussianModel, render, render_batch, query, initialize_gaussian, render_prior_oneT
 from x2_gaussian.utils.general_utils import safe_state
 from x2_gaussian.utils.cfg_utils import load_config
 from x2_gaussian.utils.log_utils import prepare_output_and_logger
@@ -47,6 +47,13 @@ def training(
     gaussians = GaussianModel(scale_bound, hyper)
     initialize_gaussian(gaussians, dataset, None)
     scene.gaussians = gaussians
+    print(
+        "Deformation network peak memory estimate at {} Gaussians: {:.2f} GB (train), {:.2f} GB (eval)".format(
+            opt.max_num_gaussians,
+            gaussians._deformation.estimate_peak_memory(opt.max_num_gaussians, grad=True) / 2**30,
+            gaussians._deformation.estimate_peak_memory(opt.max_num_gaussians, grad=False) / 2**30,
+        )
+    )
 
     scene_reconstruction(
         dataset,
@@ -166,6 +173,8 @@ def scene_reconstruction(
             render_pkg["visibility_filter"],
             render_pkg["radii"],
         )
+        # Gaussians that can receive gradient this iteration, for visible_sparse_adam
+        visible = visibility_filter
 
         # Compute loss
         gt_image = viewpoint_cam.original_image.cuda()
@@ -183,6 +192,7 @@ def scene_reconstruction(
         if stage=='fine' and iteration > 7000:
             render_pkg_prior = render_prior_oneT(viewpoint_cam, gaussians, pipe, stage)
             image_prior = render_pkg_prior["render"]    
+            visible = visible | render_pkg_prior["visibility_filter"]
             render_loss_prior = l1_loss(image_prior, gt_image)
             loss["render_prior"] = render_loss_prior
             loss["total"] += opt.lambda_prior * loss["render_prior"]
@@ -197,7 +207,7 @@ def scene_reconstruction(
             tv_vol_center = (bbox[0] + tv_vol_sVoxel / 2) + (
                 bbox[1] - tv_vol_sVoxel - bbox[0]
             ) * torch.rand(3)
-            vol_pred = query(
+            query_pkg = query(
                 gaussians,
                 tv_vol_center,
                 tv_vol_nVoxel,
@@ -205,14 +215,17 @@ def scene_reconstruction(
                 pipe,
                 viewpoint_cam.time,
                 stage,
-            )["vol"]
+            )
+            vol_pred = query_pkg["vol"]
+            visible = visible | (query_pkg["radii"] > 0)
             loss_tv = tv_3d_loss(vol_pred, reduction="mean")
             loss["tv"] = loss_tv
             loss["total"] = loss["total"] + opt.lambda_tv * loss_tv
 
         # 4D TV loss
-        if hyper.time_smoothness_weight != 0 and stage=='fine':
-            tv_loss_4d = gaussians.compute_regulation(hyper.time_smoothness_weight, hyper.l1_time_planes, hyper.plane_tv_weight)
+        if hyper.time_smoothness_weight != 0 and stage=='fine' and iteration % hyper.regulation_interval == 0:
+            k = hyper.regulation_interval  # rescaled so the average weight per iteration is unchanged
+            tv_loss_4d = gaussians.compute_regulation(k * hyper.time_smoothness_weight, k * hyper.l1_time_planes, k * hyper.plane_tv_weight)
             loss["4d_tv"] = tv_loss_4d
             loss["total"] = loss["total"] + tv_loss_4d
 
@@ -227,6 +240,13 @@ def scene_reconstruction(
                 gaussians.max_radii2D[visibility_filter], radii[visibility_filter]
             )
             gaussians.add_densification_stats(viewspace_point_tensor, visibility_filter)
+            # Mark static Gaussians before densification resets the offset statistics
+            if (
+                stage == "fine"
+                and opt.static_threshold > 0
+                and iteration % opt.densification_interval == 0
+            ):
+                gaussians.update_deformation_table(opt.static_threshold)
             if iteration < opt.densify_until_iter:
                 if (
                     iteration > opt.densify_from_iter
@@ -241,6 +261,11 @@ def scene_reconstruction(
                         densify_scale_threshold,
                         bbox,
                     )
+                    if (
+                        opt.morton_sort_interval > 0
+                        and (iteration // opt.densification_interval) % opt.morton_sort_interval == 0
+                    ):
+                        gaussians.sort_by_morton()
             if gaussians.get_density.shape[0] == 0:
                 raise ValueError(
                     "No Gaussian left. Change adaptive control hyperparameters!"
@@ -248,9 +273,17 @@ def scene_reconstruction(
 
             # Optimization
             if iteration < train_iterations:
-                gaussians.optimizer.step()
+                gaussians.optimizer.step(visible=visible)
                 gaussians.optimizer.zero_grad(set_to_none=True)
 
+            # Coarse-to-fine planes: double their resolution every plane_upsample_interval
+            if (
+                stage == "fine"
+                and gaussians.plane_resolution_scale < 1
+                and (iteration - coarse_iter) % opt.plane_upsample_interval == 0
+            ):
+                gaussians.resample_planes(min(1.0, 2 * gaussians.plane_resolution_scale))
+
             # Save gaussians
             if iteration in saving_iterations or iteration == train_iterations:
                 tqdm.write(f"[ITER {iteration}] Saving Gaussians")
@@ -280,8 +313,12 @@ def scene_reconstruction(
             metrics = {}
             for l in loss:
                 metrics["loss_" + l] = loss[l].item()
-            for param_group in gaussians.optimizer.param_groups:
-                metrics[f"lr_{param_group['name']}"] = param_group["lr"]
+            for name, lr in gaussians.learning_rates.items():
+                metrics[f"lr_{name}"] = lr
+            if hyper.profile_encodings:
+                skipped = gaussians._deformation.pop_encoding_profile()
+                metrics["skipped_encoding_gflops"] = skipped["flops"] / 1e9
+                metrics["skipped_encoding_mb"] = skipped["bytes"] / 2**20
 
             metrics['period'] = math.exp(gaussians.period.item())
 
@@ -292,7 +329,7 @@ def scene_reconstruction(
                 iter_start.elapsed_time(iter_end),
                 testing_iterations,
                 scene,
-                lambda x, y, z: render(x, y, pipe, z),
+                lambda x, y, z: render_batch(x, y, pipe, z),
                 queryfunc,
                 stage,
             )
@@ -335,12 +372,14 @@ def training_report(
                 image_show_2d = []
                 # Render projections
                 show_idx = np.linspace(0, len(config["cameras"]), 7).astype(int)[1:-1]
+                # Cameras sharing a timestamp share one deformation pass
+                rendered = renderFunc(
+                    config["cameras"],
+                    scene.gaussians,
+                    stage,
+                )["render"]
                 for idx, viewpoint in enumerate(config["cameras"]):
-                    image = renderFunc(
-                        viewpoint,
-                        scene.gaussians,
-                        stage,
-                    )["render"]
+                    image = rendered[idx]
                     gt_image = viewpoint.original_image.to("cuda")
                     images.append(image)
                     gt_images.append(gt_image)
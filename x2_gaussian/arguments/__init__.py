@@ -39,6 +39,7 @@ class PipelineParams(ParamGroup):
     def __init__(self, parser):
         self.compute_cov3D_python = False
         self.debug = False
+        self.backend = "auto"  # rasterization/voxelization backend: auto, cuda or torch (CPU reference)
         super().__init__(parser, "Pipeline Parameters")
 
 
@@ -98,6 +99,11 @@ class OptimizationParams(ParamGroup):
         self.max_screen_size = None
         self.max_scale = None  # percent of volume size
         self.max_num_gaussians = 500_000
+        self.grid_sparse_adam = False  # lazy Adam that only updates the HexPlane rows with gradient, see SparseRowAdam
+        self.visible_sparse_adam = False  # lazy Adam that only updates the Gaussians visible in the rendered projections, see PackedAdam
+        self.morton_sort_interval = 0  # re-sort the Gaussians by Morton code of their centers every k densifications, for memory locality, 0 disables
+        self.plane_upsample_interval = 2000  # fine-stage iterations between 2x HexPlane upsamplings while below full resolution (see plane_init_scale)
+        self.static_threshold = 0.0  # Gaussians whose mean position offset stays below this are marked static and skip the deformation network, 0 disables
         super().__init__(parser, "Optimization Parameters")
 
 class ModelHiddenParams(ParamGroup):
@@ -114,13 +120,15 @@ class ModelHiddenParams(ParamGroup):
         self.plane_tv_weight = 0.0001 # TV loss of spatial grid
         self.time_smoothness_weight = 0.001 # TV loss of temporal grid  0.01
         self.l1_time_planes = 0.0001  # TV loss of temporal grid
+        self.regulation_interval = 1  # apply the three plane losses above every k fine-stage iterations, with k times their weight
         self.period_regulation_weight = 1.0   # useless
         self.period_construction_weight = 1e-5  # useless
         self.kplanes_config = {
                              'grid_dimensions': 2,
                              'input_coordinate_dim': 4,
                              'output_coordinate_dim': 32,   # 32
-                             'resolution': [64, 64, 64, 150]  # [64,64,64]: resolution of spatial grid. 25: resolution of temporal grid, better to be half length of dynamic frames
+                             'resolution': [64, 64, 64, 150],  # [64,64,64]: resolution of spatial grid. 25: resolution of temporal grid, better to be half length of dynamic frames
+                             'encoder': 'hexplane',  # 'hexplane', or 'hash' for a 4D hash grid (optional keys: hash_levels, hash_features, log2_hashmap_size, hash_base_resolution)
                             }    # 150
         self.multires = [1, 2, 4, 8] # multi resolution of voxel grid
         self.no_dx=False # cancel the deformation of Gaussians' position
@@ -133,6 +141,16 @@ class ModelHiddenParams(ParamGroup):
         self.grid_pe=0 # useless, I was trying to add positional encoding to hexplane's features
         self.static_mlp=False # useless
         self.apply_rotation=False # useless
+        self.plane_init_scale = 1.0 # start the HexPlane planes at this fraction of their resolution, e.g. 0.25, and upsample them during the fine stage
+        self.plane_format = "fp32" # HexPlane storage in saved deformation.pth: fp32, fp16 or int8 (per-channel scales)
+        self.quantization_aware = False # train with the planes rounded through plane_format
+        self.compile_deformation = False # torch.compile the deformation network
+        self.compile_bucket = 0 # pad the number of Gaussians to a multiple of this for static-shape compilation, 0 uses dynamic shapes
+        self.profile_encodings = False # log FLOPs and bytes of skipped positional encodings per step
+        self.deform_chunk_size = 0 # max Gaussians per deformation network call (bounds activation memory), 0 runs all at once
+        self.deform_cache_mb = 512 # memory cap of the no-grad deformation cache used by evaluation/export, 0 disables it
+        self.bake_phases = 0 # if > 0, bake the deformation into a trajectory table of this many phases when saving
+        self.cache_spatial_features = False # keep xy/xz/yz plane features of each Gaussian between no-grad queries (costs feature_dim floats per Gaussian)
 
         
         super().__init__(parser, "ModelHiddenParams")
@@ -86,6 +86,12 @@ class Scene:
         )  # Save pickle rather than ply
 
         self.gaussians.save_deformation(point_cloud_path)
+        if stage == "fine" and self.gaussians.bake_phases > 0:
+            # Lets inference play back the motion without the deformation network
+            self.gaussians.bake_trajectories(self.gaussians.bake_phases)
+            self.gaussians.save_trajectories(
+                osp.join(point_cloud_path, "trajectories.pickle")
+            )
 
         if queryfunc is not None:
             breath_cycle = 3.0  # 呼吸周期
@@ -68,7 +68,9 @@ class Camera(nn.Module):
         self.scale = scale
 
         self.world_view_transform = (
-            torch.tensor(getWorld2View2(R, T, trans, scale)).transpose(0, 1).cuda()
+            torch.tensor(getWorld2View2(R, T, trans, scale))
+            .transpose(0, 1)
+            .to(self.data_device)
         )
         self.projection_matrix = (
             getProjectionMatrix(
@@ -78,7 +80,7 @@ class Camera(nn.Module):
                 scanner_cfg=scanner_cfg,
             )
             .transpose(0, 1)
-            .cuda()
+            .to(self.data_device)
         )
         self.full_proj_transform = (
             self.world_view_transform.unsqueeze(0).bmm(
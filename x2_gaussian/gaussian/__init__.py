@@ -1,3 +1,3 @@
 from .gaussian_model import GaussianModel
-from .render_query import render, query, render_prior_oneT
+from .render_query import render, render_batch, query, render_prior_oneT
 from .initialize import initialize_gaussian
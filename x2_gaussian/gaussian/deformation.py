@@ -1,3 +1,4 @@
+import copy
 import functools
 import math
 import os
@@ -11,8 +12,12 @@ import torch.nn.functional as F
 import torch.nn.init as init
 from x2_gaussian.gaussian.graphics_utils import apply_rotation, batch_quaternion_multiply
 from x2_gaussian.gaussian.hexplane import HexPlaneField
+from x2_gaussian.gaussian.hashgrid import HashGridField
 from x2_gaussian.gaussian.grid import DenseGrid
+from x2_gaussian.gaussian.torch_rasterizer import run_chunk
 # from scene.grid import HashHexPlane
+# Spatio-temporal encoders selectable with kplanes_config["encoder"]
+ENCODERS = {"hexplane": HexPlaneField, "hash": HashGridField}
 class Deformation(nn.Module):
     def __init__(self, D=8, W=256, input_ch=27, input_ch_time=9, grid_pe=0, skips=[], args=None):
         super(Deformation, self).__init__()
@@ -23,9 +28,20 @@ class Deformation(nn.Module):
         self.skips = skips
         self.grid_pe = grid_pe
         self.no_grid = args.no_grid
-        self.grid = HexPlaneField(args.bounds, args.kplanes_config, args.multires)
+        encoder = args.kplanes_config.get("encoder", "hexplane")
+        if encoder == "hexplane":
+            self.grid = HexPlaneField(args.bounds, args.kplanes_config, args.multires, args.plane_init_scale)
+        else:
+            self.grid = ENCODERS[encoder](args.bounds, args.kplanes_config, args.multires)
+        if args.quantization_aware and isinstance(self.grid, HexPlaneField):
+            self.grid.fake_quant_format = args.plane_format
         # breakpoint()
         self.args = args
+        # Config branches frozen at construction, so a compiled graph specializes on them
+        self.no_dx = args.no_dx
+        self.no_ds = args.no_ds
+        self.no_dr = args.no_dr
+        self.apply_rotation = args.apply_rotation
         # self.args.empty_voxel=True
         if self.args.empty_voxel:
             self.empty_voxel = DenseGrid(channels=1, world_size=[64,64,64])
@@ -33,6 +49,11 @@ class Deformation(nn.Module):
             self.static_mlp = nn.Sequential(nn.ReLU(),nn.Linear(self.W,self.W),nn.ReLU(),nn.Linear(self.W, 1))
         
         self.ratio=0
+        # Inputs ("point", "scales", "rotations") whose poc_fre encodings are read beyond
+        # the raw columns. No current path does (grid_pe encodes the grid features and
+        # no_grid reads raw xyz), so deform_network skips encoding them. A consumer of the
+        # encodings has to register its input here.
+        self.encoded_inputs = set()
         self.create_net()
     @property
     def get_aabb(self):
@@ -64,13 +85,16 @@ class Deformation(nn.Module):
         # self.density_deform = nn.Sequential(nn.ReLU(),nn.Linear(self.W,self.W),nn.ReLU(),nn.Linear(self.W, 1))
         # self.shs_deform = nn.Sequential(nn.ReLU(),nn.Linear(self.W,self.W),nn.ReLU(),nn.Linear(self.W, 16*3))
 
-    def query_time(self, rays_pts_emb, scales_emb, rotations_emb, time_feature, time_emb):
+    def query_time(self, rays_pts_emb, scales_emb, rotations_emb, time_feature, time_emb, spatial_features=None):
+        # time_emb is either [N, 1+] or a 0-dim tensor shared by all points
+        if time_emb.dim() > 0:
+            time_emb = time_emb[:,:1]
 
         if self.no_grid:
-            h = torch.cat([rays_pts_emb[:,:3],time_emb[:,:1]],-1)
+            h = torch.cat([rays_pts_emb[:,:3],time_emb.expand(rays_pts_emb.shape[0], 1)],-1)
         else:
 
-            grid_feature = self.grid(rays_pts_emb[:,:3], time_emb[:,:1])
+            grid_feature = self.grid(rays_pts_emb[:,:3], time_emb, spatial_features)
             # breakpoint()
             if self.grid_pe > 1:
                 grid_feature = poc_fre(grid_feature,self.grid_pe)
@@ -84,18 +108,18 @@ class Deformation(nn.Module):
     @property
     def get_empty_ratio(self):
         return self.ratio
-    def forward(self, rays_pts_emb, scales_emb=None, rotations_emb=None, density = None, time_feature=None, time_emb=None):
+    def forward(self, rays_pts_emb, scales_emb=None, rotations_emb=None, density = None, time_feature=None, time_emb=None, spatial_features=None):
         if time_emb is None:
             return self.forward_static(rays_pts_emb[:,:3])
         else:
-            return self.forward_dynamic(rays_pts_emb, scales_emb, rotations_emb, density, time_feature, time_emb)
+            return self.forward_dynamic(rays_pts_emb, scales_emb, rotations_emb, density, time_feature, time_emb, spatial_features)
 
     def forward_static(self, rays_pts_emb):
         grid_feature = self.grid(rays_pts_emb[:,:3])
         dx = self.static_mlp(grid_feature)
         return rays_pts_emb[:, :3] + dx
-    def forward_dynamic(self,rays_pts_emb, scales_emb, rotations_emb, density_emb, time_feature, time_emb):
-        hidden = self.query_time(rays_pts_emb, scales_emb, rotations_emb, time_feature, time_emb)
+    def forward_dynamic(self,rays_pts_emb, scales_emb, rotations_emb, density_emb, time_feature, time_emb, spatial_features=None):
+        hidden = self.query_time(rays_pts_emb, scales_emb, rotations_emb, time_feature, time_emb, spatial_features)
         if self.args.static_mlp:
             mask = self.static_mlp(hidden)
         elif self.args.empty_voxel:
@@ -103,14 +127,14 @@ class Deformation(nn.Module):
         else:
             mask = torch.ones_like(density_emb[:,0]).unsqueeze(-1)
         # breakpoint()
-        if self.args.no_dx:
+        if self.no_dx:
             pts = rays_pts_emb[:,:3]
         else:
             dx = self.pos_deform(hidden) # [50000, 3]
             # breakpoint()
             pts = torch.zeros_like(rays_pts_emb[:,:3])
             pts = rays_pts_emb[:,:3]*mask + dx
-        if self.args.no_ds :
+        if self.no_ds :
             
             scales = scales_emb[:,:3]
         else:
@@ -119,13 +143,13 @@ class Deformation(nn.Module):
             scales = torch.zeros_like(scales_emb[:,:3])
             scales = scales_emb[:,:3]*mask + ds
             
-        if self.args.no_dr :
+        if self.no_dr :
             rotations = rotations_emb[:,:4]
         else:
             dr = self.rotations_deform(hidden)
 
             rotations = torch.zeros_like(rotations_emb[:,:4])
-            if self.args.apply_rotation:
+            if self.apply_rotation:
                 rotations = batch_quaternion_multiply(rotations_emb, dr)
             else:
                 rotations = rotations_emb[:,:4] + dr
@@ -165,6 +189,16 @@ class deform_network(nn.Module):
         timenet_width = args.timenet_width
         timenet_output = args.timenet_output
         grid_pe = args.grid_pe
+        self.chunk_size = args.deform_chunk_size
+        self.profile_encodings = args.profile_encodings
+        self.skipped_encoding = {"flops": 0, "bytes": 0}
+        # Opt-in torch.compile of forward_chunk. With compile_bucket > 0 inputs are padded
+        # to a multiple of it and compiled with static shapes, else with dynamic shapes,
+        # so a changing number of Gaussians after densification does not retrace each time.
+        self.compile_bucket = args.compile_bucket
+        self.compiled_chunk = None
+        if args.compile_deformation:
+            self.compiled_chunk = torch.compile(self.forward_chunk, dynamic=self.compile_bucket <= 0)
         times_ch = 2*timebase_pe+1
         self.timenet = nn.Sequential(
         nn.Linear(times_ch, timenet_width), nn.ReLU(),
@@ -177,8 +211,8 @@ class deform_network(nn.Module):
         self.apply(initialize_weights)
         # print(self)
 
-    def forward(self, point, scales=None, rotations=None, density=None, times_sel=None):
-        return self.forward_dynamic(point, scales, rotations, density, times_sel)
+    def forward(self, point, scales=None, rotations=None, density=None, times_sel=None, spatial_features=None):
+        return self.forward_dynamic(point, scales, rotations, density, times_sel, spatial_features)
     
     @property
     def get_aabb(self):
@@ -192,12 +226,102 @@ class deform_network(nn.Module):
         points = self.deformation_net(points)
         return points
     
-    def forward_dynamic(self, point, scales=None, rotations=None, density=None, times_sel=None):
+    def get_spatial_features(self, point):
+        """Time-invariant spatial HexPlane features of the canonical points."""
+        return self.deformation_net.grid.get_spatial_features(point)
+
+    def forward_dynamic(self, point, scales=None, rotations=None, density=None, times_sel=None, spatial_features=None):
+        num_points = point.shape[0]
+        if self.chunk_size <= 0 or num_points <= self.chunk_size:
+            return self.forward_points(point, scales, rotations, density, times_sel, spatial_features)
+
+        def chunk_args(start, end):
+            per_point = lambda x: x[start:end] if torch.is_tensor(x) and x.dim() > 0 else x
+            features = None if spatial_features is None else [f[start:end] for f in spatial_features]
+            return (point[start:end], scales[start:end], rotations[start:end],
+                    per_point(density), per_point(times_sel), features)
+
+        chunks = [(start, min(start + self.chunk_size, num_points))
+                  for start in range(0, num_points, self.chunk_size)]
+        if torch.is_grad_enabled():
+            # Checkpointed chunks: only one chunk's activations are alive during backward
+            outputs = [run_chunk(self.forward_points, *chunk_args(start, end)) for start, end in chunks]
+            return tuple(torch.cat(output, 0) for output in zip(*outputs))
+
+        outputs = None
+        for start, end in chunks:
+            result = self.forward_points(*chunk_args(start, end))
+            if outputs is None:
+                outputs = [value.new_empty((num_points,) + value.shape[1:]) for value in result]
+            for output, value in zip(outputs, result):
+                output[start:end] = value
+        return tuple(outputs)
+
+    def forward_points(self, point, scales=None, rotations=None, density=None, times_sel=None, spatial_features=None):
+        """forward_chunk, through the compiled graph when compile_deformation is set."""
+        if self.compiled_chunk is None:
+            return self.forward_chunk(point, scales, rotations, density, times_sel, spatial_features)
+        num_points = point.shape[0]
+        if self.compile_bucket <= 0:
+            return self.compiled_chunk(point, scales, rotations, density, times_sel, spatial_features)
+
+        # Repeat the last row up to the bucket size; padded rows are sliced off, so they
+        # get zero gradients (unlike zero rows, which give NaNs in quaternion normalization)
+        num_pad = -num_points % self.compile_bucket
+        def pad(x):
+            if not torch.is_tensor(x) or x.dim() == 0 or num_pad == 0:
+                return x
+            return torch.cat([x, x[-1:].expand(num_pad, *x.shape[1:])], 0)
+        features = None if spatial_features is None else [pad(f) for f in spatial_features]
+        outputs = self.compiled_chunk(pad(point), pad(scales), pad(rotations), pad(density),
+                                      pad(times_sel), features)
+        return tuple(output[:num_points] for output in outputs)
+
+    def estimate_peak_memory(self, num_points, grad=True):
+        """Rough peak memory in bytes of one forward_dynamic call over num_points Gaussians.
+
+        Counts the float32 activations per point of the embeddings, grid sampling and
+        MLPs for one chunk (all points without chunking), the outputs of all points and
+        the network parameters. With grad, the parameters are counted three times: the
+        weights, their gradients and the dense plane gradients of the chunk in flight.
+        """
+        net = self.deformation_net
+        embed = sum(
+            dim * (1 + 2 * poc_buf.numel())
+            for name, dim, poc_buf in [("point", 3, self.pos_poc), ("scales", 3, self.rotation_scaling_poc),
+                                       ("rotations", 4, self.rotation_scaling_poc)]
+            if name in net.encoded_inputs
+        )
+        sampling = net.grid.activations_per_point()
+        mlp = net.W * (2 * net.D - 1) + 9 * net.W + 10
+        outputs = 10
+        chunk = num_points if self.chunk_size <= 0 else min(self.chunk_size, num_points)
+        parameters = sum(p.numel() for p in self.parameters()) * (3 if grad else 1)
+        return 4 * (num_points * outputs + chunk * (embed + sampling + mlp) + parameters)
+
+    def encode(self, name, input_data, poc_buf):
+        """poc_fre of an input if the deformation net reads its encoding, else the raw input
+        (the leading columns of poc_fre are the raw input, so slices stay the same)."""
+        if name in self.deformation_net.encoded_inputs:
+            return poc_fre(input_data, poc_buf)
+        if self.profile_encodings:
+            flops, nbytes = poc_fre_cost(input_data.shape[0], input_data.shape[1], poc_buf.numel())
+            self.skipped_encoding["flops"] += flops
+            self.skipped_encoding["bytes"] += nbytes
+        return input_data
+
+    def pop_encoding_profile(self):
+        """FLOPs and bytes of skipped encodings since the last call."""
+        skipped = self.skipped_encoding
+        self.skipped_encoding = {"flops": 0, "bytes": 0}
+        return skipped
+
+    def forward_chunk(self, point, scales=None, rotations=None, density=None, times_sel=None, spatial_features=None):
         # times_emb = poc_fre(times_sel, self.time_poc)
-        point_emb = poc_fre(point,self.pos_poc)
+        point_emb = self.encode("point", point, self.pos_poc)
         # breakpoint()
-        scales_emb = poc_fre(scales,self.rotation_scaling_poc)
-        rotations_emb = poc_fre(rotations,self.rotation_scaling_poc)
+        scales_emb = self.encode("scales", scales, self.rotation_scaling_poc)
+        rotations_emb = self.encode("rotations", rotations, self.rotation_scaling_poc)
         # time_emb = poc_fre(times_sel, self.time_poc)
         # times_feature = self.timenet(time_emb)
         means3D, scales, rotations = self.deformation_net( point_emb,
@@ -205,7 +329,8 @@ class deform_network(nn.Module):
                                                 rotations_emb,
                                                 density,
                                                 None,
-                                                times_sel)
+                                                times_sel,
+                                                spatial_features)
     
        
         return means3D, scales, rotations #, density
@@ -216,6 +341,37 @@ class deform_network(nn.Module):
     def get_grid_parameters(self):
         return self.deformation_net.get_grid_parameters()
 
+def architecture_from_state_dict(state_dict, args):
+    """ModelHiddenParams for the network size saved in a deform_network state dict.
+
+    Returns args itself if the sizes match, else a copy with net_width, defor_depth and,
+    for HexPlane grids, multires and output_coordinate_dim read from the tensor shapes,
+    so load_model can rebuild the network for a student from distill_deformation().
+    """
+    prefix = "deformation_net."
+    net_width = state_dict[prefix + "feature_out.0.weight"].shape[0]
+    defor_depth = len([key for key in state_dict
+                       if key.startswith(prefix + "feature_out.") and key.endswith(".weight")])
+    levels = []
+    while f"{prefix}grid.grids.{len(levels)}.0" in state_dict:
+        levels.append(state_dict[f"{prefix}grid.grids.{len(levels)}.0"])
+    matches = net_width == args.net_width and defor_depth == args.defor_depth
+    if levels:
+        matches = (matches and len(levels) == len(args.multires)
+                   and levels[0].shape[1] == args.kplanes_config["output_coordinate_dim"])
+    if matches:
+        return args
+
+    args = copy.copy(args)
+    args.net_width = net_width
+    args.defor_depth = defor_depth
+    if levels:
+        args.kplanes_config = dict(args.kplanes_config, output_coordinate_dim=levels[0].shape[1])
+        # Exact for full-resolution planes; the grid adopts the saved shapes either way
+        args.multires = [max(1, round(plane.shape[-1] / args.kplanes_config["resolution"][0]))
+                         for plane in levels]
+    return args
+
 def initialize_weights(m):
     if isinstance(m, nn.Linear):
         # init.constant_(m.weight, 0)
@@ -229,4 +385,14 @@ def poc_fre(input_data,poc_buf):
     input_data_sin = input_data_emb.sin()
     input_data_cos = input_data_emb.cos()
     input_data_emb = torch.cat([input_data, input_data_sin,input_data_cos], -1)
-    return input_data_emb
\ No newline at end of file
+    return input_data_emb
+
+def poc_fre_cost(num_points, dim, num_freqs):
+    """Forward FLOPs (sin/cos counted as one) and float32 bytes moved by poc_fre."""
+    raw = num_points * dim
+    expanded = raw * num_freqs
+    flops = 3 * expanded  # scale, sin, cos
+    # scale: read raw, write expanded; sin, cos: read and write expanded each;
+    # cat: read and write raw + 2 * expanded
+    nbytes = 4 * (3 * raw + 9 * expanded)
+    return flops, nbytes
@@ -10,6 +10,7 @@
 #
 import os
 import sys
+import weakref
 import torch
 from torch import nn
 import numpy as np
@@ -18,27 +19,73 @@ from plyfile import PlyData, PlyElement
 import time
 import math
 import torch.nn.functional as F
+from collections import OrderedDict
 
 sys.path.append("./")
 
-from simple_knn._C import distCUDA2
 from x2_gaussian.utils.general_utils import t2a
 from x2_gaussian.utils.system_utils import mkdir_p
 from x2_gaussian.utils.gaussian_utils import (
     inverse_sigmoid,
     get_expon_lr_func,
+    get_expon_lr_table,
     build_rotation,
     inverse_softplus,
     strip_symmetric,
     build_scaling_rotation,
 )
-from x2_gaussian.gaussian.deformation import deform_network
-from x2_gaussian.gaussian.regulation import compute_plane_smoothness
+from x2_gaussian.gaussian.deformation import deform_network, architecture_from_state_dict
+from x2_gaussian.gaussian.hexplane import HexPlaneField, resample_plane
+from x2_gaussian.gaussian.knn import mean_knn_dist2
+from x2_gaussian.gaussian.optimizer import SparseRowAdam, PackedAdam
+from x2_gaussian.gaussian.storage import RowStorage
+from x2_gaussian.gaussian.spatial_index import SpatialIndex, morton_order
+from x2_gaussian.gaussian.regulation import compute_plane_smoothness, compute_fused_plane_regulation
 
 EPS = 1e-5
+SCAN_TIME = 60.0  # seconds, times are normalized by the scan duration
+# Columns of the per-Gaussian attributes in GaussianModel._packed
+PACKED_COLUMNS = {"xyz": slice(0, 3), "density": slice(3, 4), "scaling": slice(4, 7), "rotation": slice(7, 11)}
+PACKED_DIM = 11
+# Per-row optimizer state of _packed, last_step only with visible_sparse_adam
+PACKED_STATE = ["exp_avg", "exp_avg_sq", "last_step"]
+# Per-Gaussian attributes besides _packed, by name in RowStorage
+POINT_STATS = {
+    "xyz_gradient_accum": "xyz_gradient_accum",
+    "denom": "denom",
+    "max_radii2D": "max_radii2D",
+    "deformation_accum": "_deformation_accum",
+    "deformation_table": "_deformation_table",
+}
+
+
+def packed_attribute(name):
+    """Property for the columns of one attribute in GaussianModel._packed. Assigning a
+    tensor with another number of Gaussians starts a new, zeroed _packed."""
+    columns = PACKED_COLUMNS[name]
+
+    def getter(self):
+        return self._packed[:, columns]
+
+    def setter(self, value):
+        value = value.detach()
+        if self._packed.shape[0] != value.shape[0]:
+            self._packed = nn.Parameter(
+                torch.zeros((value.shape[0], PACKED_DIM), dtype=value.dtype, device=value.device)
+            )
+        with torch.no_grad():
+            self._packed[:, columns] = value
+
+    return property(getter, setter)
 
 
 class GaussianModel:
+    # Views of _packed, in which all per-Gaussian parameters are optimized
+    _xyz = packed_attribute("xyz")  # world coordinate
+    _density = packed_attribute("density")  # density
+    _scaling = packed_attribute("scaling")  # 3d scale
+    _rotation = packed_attribute("rotation")  # rotation expressed in quaternions
+
     def setup_functions(self):
         def build_covariance_from_scaling_rotation(scaling, scaling_modifier, rotation):
             L = build_scaling_rotation(scaling_modifier * scaling, rotation)
@@ -71,24 +118,52 @@ class GaussianModel:
 
         # print(self.scale_bound,  scale_max_bound , scale_min_bound)
 
-    def __init__(self, scale_bound=None, args=None):
-        self._xyz = torch.empty(0)  # world coordinate
-        self._scaling = torch.empty(0)  # 3d scale
-        self._rotation = torch.empty(0)  # rotation expressed in quaternions
-        self._density = torch.empty(0)  # density
+    def __init__(self, scale_bound=None, args=None, device=None):
+        # Device of the Gaussians and the deformation network, the GPU when there is one
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        self._packed = torch.empty(0, PACKED_DIM)  # [N, 11] xyz, density, scaling, rotation
         self.max_radii2D = torch.empty(0)
         self.xyz_gradient_accum = torch.empty(0)
         self.denom = torch.empty(0)
         self.optimizer = None
         self.spatial_lr_scale = 0
         self.scale_bound = scale_bound
+        self.deform_args = args  # hyperparameters of _deformation, see load_model
         self._deformation = deform_network(args)
-        self._deformation_table = torch.empty(0)
+        self._deformation_table = torch.empty(0)  # False marks static Gaussians that skip the deformation network
+        self._deformation_accum = torch.empty(0)
+        self._deformation_steps = 0
         self.period = torch.empty(0)
-        self.t_seq = torch.linspace(0, args.kplanes_config['resolution'][3]-1, args.kplanes_config['resolution'][3]).cuda()
+        self.t_seq = torch.linspace(0, args.kplanes_config['resolution'][3]-1, args.kplanes_config['resolution'][3]).to(self.device)
+        # Deformed Gaussians computed without grad, keyed by (version, time, stage).
+        # The version is bumped whenever parameters change, which drops the cache.
+        self.version = 0
+        self.deform_cache = OrderedDict()
+        self.deform_cache_bytes = int(args.deform_cache_mb * 1024**2)
+        # Opt-in: spatial-plane features of _xyz, reused by no-grad queries at any time
+        self.cache_spatial_features = args.cache_spatial_features
+        self.spatial_feature_cache = None
+        # Baked per-Gaussian trajectories over one period, see bake_trajectories()
+        self.trajectories = None
+        self.bake_phases = args.bake_phases
+        # Format of the HexPlane planes written by save_deformation
+        self.plane_format = args.plane_format
+        # Preallocated rows for densification. The per-Gaussian tensors are views of it;
+        # _published holds the ones it last handed out, to spot tensors replaced since.
+        self.storage = RowStorage()
+        self._published = {}
+        # Grid over the centers for gaussians_in_box / gaussians_near, built on first use and
+        # again once densification or pruning replaced _packed
+        self._spatial_index = None
+        self._spatial_index_source = None
         self.setup_functions()
 
     def capture(self):
+        if self.storage.capacity > self.storage.size:
+            # Views save their whole buffer, spare rows included
+            self._sync_storage()
+            self.storage.shrink_to_fit()
+            self._publish_storage()
         return (
             self._xyz,
             self._scaling,
@@ -122,6 +197,7 @@ class GaussianModel:
             self.period,
         ) = model_args
         self._deformation.load_state_dict(deform_state)
+        self.bump_version()
         self.training_setup(training_args)
         self.xyz_gradient_accum = xyz_gradient_accum
         self.denom = denom
@@ -148,9 +224,207 @@ class GaussianModel:
         return self.covariance_activation(
             self.get_scaling, scaling_modifier, self._rotation
         )
+
+    def bump_version(self):
+        """Mark parameters as changed and drop cached deformations."""
+        self.version += 1
+        self.deform_cache.clear()
+        self.spatial_feature_cache = None
+        self.trajectories = None
+
+    def get_deformed(self, time, stage="fine"):
+        """Deformed (means3D, scales, rotations) at a time, before activation.
+
+        Without grad, results are kept in an LRU cache capped at deform_cache_bytes,
+        so evaluation and export loops over the same phases reuse them. Stage "baked"
+        plays back the table from bake_trajectories() instead of the deformation network.
+        """
+        means3D = self.get_xyz
+        scales = self._scaling
+        rotations = self._rotation
+        if stage == "coarse":
+            return means3D, scales, rotations
+        if stage == "baked":
+            return self.get_baked(time)
+
+        use_cache = not torch.is_grad_enabled() and self.deform_cache_bytes > 0
+        if use_cache:
+            key = (self.version, float(time), stage)
+            if key in self.deform_cache:
+                self.deform_cache.move_to_end(key)
+                return self.deform_cache[key]
+
+        spatial_features = None
+        if self.cache_spatial_features and not torch.is_grad_enabled():
+            # Dropped by bump_version() whenever _xyz or the grids change
+            if self.spatial_feature_cache is None:
+                self.spatial_feature_cache = self._deformation.get_spatial_features(means3D)
+            spatial_features = self.spatial_feature_cache
+
+        time = torch.tensor(time).to(means3D.device)  # 0-dim, shared by all Gaussians
+        deformed = self.deform(time, spatial_features)
+
+        if use_cache:
+            nbytes = sum(t.numel() * t.element_size() for t in deformed)
+            if nbytes <= self.deform_cache_bytes:
+                self.deform_cache[key] = deformed
+                cached_bytes = sum(
+                    t.numel() * t.element_size()
+                    for value in self.deform_cache.values()
+                    for t in value
+                )
+                while cached_bytes > self.deform_cache_bytes:
+                    _, evicted = self.deform_cache.popitem(last=False)
+                    cached_bytes -= sum(t.numel() * t.element_size() for t in evicted)
+        return deformed
     
+    def deform(self, time, spatial_features=None):
+        """Run the deformation network at a 0-dim time tensor.
+
+        Gaussians marked static in _deformation_table keep their canonical parameters and
+        skip the network. With grad enabled (training), position offsets are accumulated
+        into _deformation_accum for update_deformation_table().
+        """
+        means3D = self._xyz
+        scales = self._scaling
+        rotations = self._rotation
+        density = self.get_density
+        indices = None
+        table = self._deformation_table
+        if table.shape[0] == means3D.shape[0] and not table.all():
+            indices = table.nonzero(as_tuple=True)[0]
+            if indices.numel() == 0:
+                return means3D, scales, rotations
+            means3D, scales, rotations, density = (
+                x[indices] for x in (means3D, scales, rotations, density)
+            )
+            if spatial_features is not None:
+                spatial_features = [f[indices] for f in spatial_features]
+
+        deformed = self._deformation(
+            means3D, scales, rotations, density, time, spatial_features
+        )
+
+        if torch.is_grad_enabled() and self._deformation_accum.shape[0] == self._xyz.shape[0]:
+            offset = (deformed[0] - means3D).detach().abs()
+            if indices is None:
+                self._deformation_accum += offset
+            else:
+                self._deformation_accum.index_add_(0, indices, offset)
+            self._deformation_steps += 1
+
+        if indices is None:
+            return deformed
+        # Scatter the dynamic subset back, static Gaussians stay canonical
+        return tuple(
+            base.index_put((indices,), value)
+            for base, value in zip((self._xyz, self._scaling, self._rotation), deformed)
+        )
+
+    def bake_trajectories(self, num_phases, dtype=torch.float16):
+        """Evaluate the deformation at num_phases times evenly spread over one learned
+        period and keep the per-Gaussian offsets from the canonical parameters.
+
+        Offsets are small, so they are stored compactly in dtype. The table is only
+        valid for the parameters it was baked from and is dropped by bump_version().
+        """
+        period = math.exp(self.period.item())
+        tables = {"xyz": [], "scale": [], "rotation": []}
+        canonical = (self._xyz, self._scaling, self._rotation)
+        with torch.no_grad():
+            for k in range(num_phases):
+                deformed = self.get_deformed(k / num_phases * period / SCAN_TIME, "fine")
+                for table, value, base in zip(tables.values(), deformed, canonical):
+                    table.append((value - base).to(dtype))
+        self.trajectories = {"period": period}
+        for name, table in tables.items():
+            self.trajectories[name] = torch.stack(table, 0)  # [num_phases, N, C]
+
+    def get_baked(self, time):
+        """Deformed (means3D, scales, rotations) at a time, linearly interpolated from
+        the baked trajectory table with wrap-around over the period."""
+        assert self.trajectories is not None, "Call bake_trajectories() or load_trajectories() first."
+        num_phases = self.trajectories["xyz"].shape[0]
+        phase = (float(time) * SCAN_TIME / self.trajectories["period"]) % 1.0 * num_phases
+        k0 = int(phase) % num_phases
+        k1 = (k0 + 1) % num_phases
+        weight = phase - int(phase)
+        canonical = (self._xyz, self._scaling, self._rotation)
+        return tuple(
+            base + torch.lerp(
+                self.trajectories[name][k0].to(base.dtype),
+                self.trajectories[name][k1].to(base.dtype),
+                weight,
+            )
+            for name, base in zip(("xyz", "scale", "rotation"), canonical)
+        )
+
+    def save_trajectories(self, path):
+        mkdir_p(os.path.dirname(path))
+        out = {name: t2a(value) for name, value in self.trajectories.items()}
+        with open(path, "wb") as f:
+            pickle.dump(out, f, pickle.HIGHEST_PROTOCOL)
+
+    def load_trajectories(self, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        self.trajectories = {"period": float(data["period"])}
+        for name in ["xyz", "scale", "rotation"]:
+            self.trajectories[name] = torch.tensor(data[name], device=self._xyz.device)
+
+    def distill_deformation(self, student_args, iterations=5000, batch_size=16384,
+                            mlp_lr=1e-3, grid_lr=1e-2):
+        """Fit a smaller deform_network built from student_args to the current one and
+        swap it in, e.g. with fewer multires levels or a lower output_coordinate_dim or
+        net_width.
+
+        The student regresses the teacher's deformed (means3D, scales, rotations) of random
+        dynamic Gaussians at random times over the scan, i.e. its (dx, ds, dr). Learning
+        rates decay 10x over the run. save_deformation() then writes the student in the
+        usual deformation.pth layout, which load_model() reads back at its size. Returns
+        the final distillation loss.
+        """
+        device = self._xyz.device
+        teacher = self._deformation
+        student = deform_network(student_args).to(device)
+        student.deformation_net.set_aabb(*[bound.tolist() for bound in teacher.get_aabb])
+        optimizer = torch.optim.Adam([
+            {"params": student.get_mlp_parameters(), "lr": mlp_lr, "name": "deformation"},
+            {"params": student.get_grid_parameters(), "lr": grid_lr, "name": "grid"},
+        ], eps=1e-15)
+        schedulers = {
+            "deformation": get_expon_lr_func(lr_init=mlp_lr, lr_final=mlp_lr / 10, max_steps=iterations),
+            "grid": get_expon_lr_func(lr_init=grid_lr, lr_final=grid_lr / 10, max_steps=iterations),
+        }
+
+        table = self._deformation_table
+        if table.shape[0] == self._xyz.shape[0]:
+            dynamic = table.nonzero(as_tuple=True)[0]
+        else:
+            dynamic = torch.arange(self._xyz.shape[0], device=device)
+        canonical = (self._xyz.detach(), self._scaling.detach(), self._rotation.detach(),
+                     self.get_density.detach())
+        for iteration in range(iterations):
+            for group in optimizer.param_groups:
+                group["lr"] = schedulers[group["name"]](iteration)
+            indices = dynamic[torch.randint(dynamic.shape[0], (batch_size,), device=device)]
+            inputs = [x[indices] for x in canonical]
+            times = torch.rand(batch_size, 1, device=device)
+            with torch.no_grad():
+                target = teacher(*inputs, times)
+            output = student(*inputs, times)
+            loss = sum(F.mse_loss(value, reference) for value, reference in zip(output, target))
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+
+        self.deform_args = student_args
+        self._deformation = student
+        self.bump_version()
+        return loss.item()
+
     def parameters(self):
-        module_params = [self._xyz, self._scaling, self._rotation, self._density]
+        module_params = [self._packed]
         module_params.extend(self._deformation.parameters())
         module_params.extend(self.period)
 
@@ -160,18 +434,18 @@ class GaussianModel:
     def create_from_pcd(self, xyz, density, spatial_lr_scale: float):
         self.spatial_lr_scale = spatial_lr_scale
 
-        fused_point_cloud = torch.tensor(xyz).float().cuda()
+        fused_point_cloud = torch.tensor(xyz).float().to(self.device)
         print(
             "Initialize gaussians from {} estimated points".format(
                 fused_point_cloud.shape[0]
             )
         )
         fused_density = (
-            self.density_inverse_activation(torch.tensor(density)).float().cuda()
+            self.density_inverse_activation(torch.tensor(density)).float().to(self.device)
         )
         dist = torch.sqrt(
             torch.clamp_min(
-                distCUDA2(fused_point_cloud),
+                mean_knn_dist2(fused_point_cloud),
                 0.001**2,
             )
         )
@@ -181,138 +455,113 @@ class GaussianModel:
             )  # Avoid overflow
 
         scales = self.scaling_inverse_activation(dist)[..., None].repeat(1, 3)
-        rots = torch.zeros((fused_point_cloud.shape[0], 4), device="cuda")
+        rots = torch.zeros((fused_point_cloud.shape[0], 4), device=self.device)
         rots[:, 0] = 1
 
-        self._xyz = nn.Parameter(fused_point_cloud.requires_grad_(True))
-        self._scaling = nn.Parameter(scales.requires_grad_(True))
-        self._rotation = nn.Parameter(rots.requires_grad_(True))
-        self._density = nn.Parameter(fused_density.requires_grad_(True))
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self._packed = nn.Parameter(
+            torch.cat([fused_point_cloud, fused_density, scales, rots], dim=1).requires_grad_(True)
+        )
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
         # self.period = nn.Parameter(torch.FloatTensor([2.8]).cuda().requires_grad_(True))
-        self.period = nn.Parameter(torch.FloatTensor([np.log(2.8)]).cuda().requires_grad_(True))
+        self.period = nn.Parameter(torch.FloatTensor([np.log(2.8)]).to(self.device).requires_grad_(True))
 
-        self._deformation = self._deformation.to("cuda") 
-        self._deformation_table = torch.gt(torch.ones((self.get_xyz.shape[0]),device="cuda"),0)
+        self._deformation = self._deformation.to(self.device) 
+        self._deformation_table = torch.gt(torch.ones((self.get_xyz.shape[0]),device=self.device),0)
 
         #! Generate one gaussian for debugging purpose
         if False:
             print("Initialize one gaussian")
             fused_xyz = (
-                torch.tensor([[0.0, 0.0, 0.0]]).float().cuda()
+                torch.tensor([[0.0, 0.0, 0.0]]).float().to(self.device)
             )  # position: [0,0,0]
             fused_density = self.density_inverse_activation(
-                torch.tensor([[0.8]]).float().cuda()
+                torch.tensor([[0.8]]).float().to(self.device)
             )  # density: 0.8
             scales = self.scaling_inverse_activation(
-                torch.tensor([[0.5, 0.5, 0.5]]).float().cuda()
+                torch.tensor([[0.5, 0.5, 0.5]]).float().to(self.device)
             )  # scale: 0.5
             rots = (
-                torch.tensor([[1.0, 0.0, 0.0, 0.0]]).float().cuda()
+                torch.tensor([[1.0, 0.0, 0.0, 0.0]]).float().to(self.device)
             )  # quaternion: [1, 0, 0, 0]
-            # rots = torch.tensor([[0.966, -0.259, 0, 0]]).float().cuda()
+            # rots = torch.tensor([[0.966, -0.259, 0, 0]]).float().to(self.device)
             self._xyz = nn.Parameter(fused_xyz.requires_grad_(True))
             self._scaling = nn.Parameter(scales.requires_grad_(True))
             self._rotation = nn.Parameter(rots.requires_grad_(True))
             self._density = nn.Parameter(fused_density.requires_grad_(True))
-            self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+            self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
 
     def training_setup(self, training_args):
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self._deformation_accum = torch.zeros((self.get_xyz.shape[0],3),device="cuda")
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self._deformation_accum = torch.zeros((self.get_xyz.shape[0],3),device=self.device)
+        self._deformation_steps = 0
+
+        # Exponential schedules as (lr_init, lr_final, lr_delay_mult, max_steps), evaluated
+        # together by one vectorized table in update_learning_rate
+        schedules = {
+            "xyz": (training_args.position_lr_init, training_args.position_lr_final,
+                    1.0, training_args.position_lr_max_steps),
+            "density": (training_args.density_lr_init, training_args.density_lr_final,
+                        1.0, training_args.density_lr_max_steps),
+            "scaling": (training_args.scaling_lr_init, training_args.scaling_lr_final,
+                        1.0, training_args.scaling_lr_max_steps),
+            "rotation": (training_args.rotation_lr_init, training_args.rotation_lr_final,
+                         1.0, training_args.rotation_lr_max_steps),
+            "deformation": (training_args.deformation_lr_init, training_args.deformation_lr_final,
+                            training_args.deformation_lr_delay_mult, training_args.position_lr_max_steps),
+            "grid": (training_args.grid_lr_init, training_args.grid_lr_final,
+                     training_args.deformation_lr_delay_mult, training_args.position_lr_max_steps),
+            "period": (training_args.period_lr_init, training_args.period_lr_final,
+                       1.0, training_args.period_lr_max_steps),
+        }
+        self.schedule_names = list(schedules.keys())
+        lr_init, lr_final, lr_delay_mult, max_steps = (np.array(x, dtype=np.float64) for x in zip(*schedules.values()))
+        self.lr_table = get_expon_lr_table(
+            lr_init=lr_init * self.spatial_lr_scale,
+            lr_final=lr_final * self.spatial_lr_scale,
+            lr_delay_mult=lr_delay_mult,
+            max_steps=max_steps,
+        )
+        # Schedule of each column of _packed
+        self.packed_schedule = np.zeros(PACKED_DIM, dtype=np.int64)
+        for name, columns in PACKED_COLUMNS.items():
+            self.packed_schedule[columns] = self.schedule_names.index(name)
+        lrs = self.lr_table(0)
 
         l = [
             {
-                "params": [self._xyz],
-                "lr": training_args.position_lr_init * self.spatial_lr_scale,
-                "name": "xyz",
-            },
-            {
-                "params": [self._density],
-                "lr": training_args.density_lr_init * self.spatial_lr_scale,
-                "name": "density",
-            },
-            {
-                "params": [self._scaling],
-                "lr": training_args.scaling_lr_init * self.spatial_lr_scale,
-                "name": "scaling",
-            },
-            {
-                "params": [self._rotation],
-                "lr": training_args.rotation_lr_init * self.spatial_lr_scale,
-                "name": "rotation",
+                "params": [self._packed],
+                "lr": 0.0,
+                "column_lr": torch.tensor(lrs[self.packed_schedule], dtype=torch.float, device=self._packed.device),
+                "name": "packed",
+                "visible_rows": training_args.visible_sparse_adam,
             },
             {'params': list(self._deformation.get_mlp_parameters()), 'lr': training_args.deformation_lr_init * self.spatial_lr_scale, "name": "deformation"},
-            {'params': list(self._deformation.get_grid_parameters()), 'lr': training_args.grid_lr_init * self.spatial_lr_scale, "name": "grid"},
+            {'params': list(self._deformation.get_grid_parameters()), 'lr': training_args.grid_lr_init * self.spatial_lr_scale, "name": "grid", "sparse_rows": training_args.grid_sparse_adam},
             {
                 "params": [self.period],
                 "lr": training_args.period_lr_init * self.spatial_lr_scale,
                 "name": "period",
             },
         ]
+        # Index of each group's schedule, the packed group takes column_lr instead
+        self.group_schedule = [
+            None if "column_lr" in group else self.schedule_names.index(group["name"]) for group in l
+        ]
 
-        self.optimizer = torch.optim.Adam(l, lr=0.0, eps=1e-15)
-        self.xyz_scheduler_args = get_expon_lr_func(
-            lr_init=training_args.position_lr_init * self.spatial_lr_scale,
-            lr_final=training_args.position_lr_final * self.spatial_lr_scale,
-            max_steps=training_args.position_lr_max_steps,
-        )
-        self.density_scheduler_args = get_expon_lr_func(
-            lr_init=training_args.density_lr_init * self.spatial_lr_scale,
-            lr_final=training_args.density_lr_final * self.spatial_lr_scale,
-            max_steps=training_args.density_lr_max_steps,
-        )
-        self.scaling_scheduler_args = get_expon_lr_func(
-            lr_init=training_args.scaling_lr_init * self.spatial_lr_scale,
-            lr_final=training_args.scaling_lr_final * self.spatial_lr_scale,
-            max_steps=training_args.scaling_lr_max_steps,
-        )
-        self.rotation_scheduler_args = get_expon_lr_func(
-            lr_init=training_args.rotation_lr_init * self.spatial_lr_scale,
-            lr_final=training_args.rotation_lr_final * self.spatial_lr_scale,
-            max_steps=training_args.rotation_lr_max_steps,
-        )
-
-        self.deformation_scheduler_args = get_expon_lr_func(lr_init=training_args.deformation_lr_init*self.spatial_lr_scale,
-                                                    lr_final=training_args.deformation_lr_final*self.spatial_lr_scale,
-                                                    lr_delay_mult=training_args.deformation_lr_delay_mult,
-                                                    max_steps=training_args.position_lr_max_steps)    
-        self.grid_scheduler_args = get_expon_lr_func(lr_init=training_args.grid_lr_init*self.spatial_lr_scale,
-                                                    lr_final=training_args.grid_lr_final*self.spatial_lr_scale,
-                                                    lr_delay_mult=training_args.deformation_lr_delay_mult,
-                                                    max_steps=training_args.position_lr_max_steps)  
-        
-        self.period_scheduler_args = get_expon_lr_func(
-            lr_init=training_args.period_lr_init * self.spatial_lr_scale,
-            lr_final=training_args.period_lr_final * self.spatial_lr_scale,
-            max_steps=training_args.period_lr_max_steps,
-        )
+        self.optimizer = PackedAdam(l, lr=0.0, eps=1e-15, foreach=True)
+        self.optimizer.register_step_post_hook(lambda *_: self.bump_version())
+        self.learning_rates = dict(zip(self.schedule_names, lrs.tolist()))
 
     def update_learning_rate(self, iteration):
         """Learning rate scheduling per step"""
-        for param_group in self.optimizer.param_groups:
-            if param_group["name"] == "xyz":
-                lr = self.xyz_scheduler_args(iteration)
-                param_group["lr"] = lr
-            if param_group["name"] == "density":
-                lr = self.density_scheduler_args(iteration)
-                param_group["lr"] = lr
-            if param_group["name"] == "scaling":
-                lr = self.scaling_scheduler_args(iteration)
-                param_group["lr"] = lr
-            if param_group["name"] == "rotation":
-                lr = self.rotation_scheduler_args(iteration)
-                param_group["lr"] = lr
-            if  "grid" in param_group["name"]:
-                lr = self.grid_scheduler_args(iteration)
-                param_group['lr'] = lr
-            if param_group["name"] == "deformation":
-                lr = self.deformation_scheduler_args(iteration)
-                param_group['lr'] = lr
-            if param_group["name"] == "period":
-                lr = self.period_scheduler_args(iteration)
-                param_group['lr'] = lr
+        lrs = self.lr_table(iteration)
+        for group, schedule in zip(self.optimizer.param_groups, self.group_schedule):
+            if schedule is None:
+                group["column_lr"].copy_(torch.from_numpy(lrs[self.packed_schedule]), non_blocking=True)
+            else:
+                group["lr"] = float(lrs[schedule])
+        self.learning_rates = dict(zip(self.schedule_names, lrs.tolist()))
 
     def construct_list_of_attributes(self):
         l = ["x", "y", "z", "nx", "ny", "nz"]
@@ -332,20 +581,32 @@ class GaussianModel:
     
     def load_model(self, path):
         print("loading model from exists{}".format(path))
-        weight_dict = torch.load(os.path.join(path,"deformation.pth"),map_location="cuda")
+        weight_dict = torch.load(os.path.join(path,"deformation.pth"),map_location=self.device)
+        args = architecture_from_state_dict(weight_dict, self.deform_args)
+        if args is not self.deform_args:
+            # E.g. a student from distill_deformation(), smaller than the configured network
+            print(f"Deformation network size from checkpoint: net_width {args.net_width}, multires {args.multires}")
+            self.deform_args = args
+            self._deformation = deform_network(args)
         self._deformation.load_state_dict(weight_dict)
-        self._deformation = self._deformation.to("cuda")
-        self._deformation_table = torch.gt(torch.ones((self.get_xyz.shape[0]),device="cuda"),0)
-        self._deformation_accum = torch.zeros((self.get_xyz.shape[0],3),device="cuda")
+        self._deformation = self._deformation.to(self.device)
+        self.bump_version()
+        self._deformation_table = torch.gt(torch.ones((self.get_xyz.shape[0]),device=self.device),0)
+        self._deformation_accum = torch.zeros((self.get_xyz.shape[0],3),device=self.device)
         if os.path.exists(os.path.join(path, "deformation_table.pth")):
-            self._deformation_table = torch.load(os.path.join(path, "deformation_table.pth"),map_location="cuda")
+            self._deformation_table = torch.load(os.path.join(path, "deformation_table.pth"),map_location=self.device)
         if os.path.exists(os.path.join(path, "deformation_accum.pth")):
-            self._deformation_accum = torch.load(os.path.join(path, "deformation_accum.pth"),map_location="cuda")
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+            self._deformation_accum = torch.load(os.path.join(path, "deformation_accum.pth"),map_location=self.device)
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
         # print(self._deformation.deformation_net.grid.)
 
     def save_deformation(self, path):
-        torch.save(self._deformation.state_dict(),os.path.join(path, "deformation.pth"))
+        state_dict = self._deformation.state_dict()
+        grid = self._deformation.deformation_net.grid
+        if self.plane_format != "fp32" and isinstance(grid, HexPlaneField):
+            # Compact planes, load_model picks the format up from the checkpoint
+            grid.quantize_state_dict(state_dict, "deformation_net.grid.", self.plane_format)
+        torch.save(state_dict,os.path.join(path, "deformation.pth"))
         torch.save(self._deformation_table,os.path.join(path, "deformation_table.pth"))
         torch.save(self._deformation_accum,os.path.join(path, "deformation_accum.pth"))
 
@@ -377,130 +638,141 @@ class GaussianModel:
                 self.get_density, torch.ones_like(self.get_density) * reset_density
             )
         )
-        optimizable_tensors = self.replace_tensor_to_optimizer(densities_new, "density")
-        self._density = optimizable_tensors["density"]
+        self.replace_tensor_to_optimizer(densities_new, "density")
 
     def load_ply(self, path):
         # We load pickle file.
         with open(path, "rb") as f:
             data = pickle.load(f)
 
-        self._xyz = nn.Parameter(
-            torch.tensor(data["xyz"], dtype=torch.float, device="cuda").requires_grad_(
-                True
-            )
+        packed = np.concatenate(
+            [data["xyz"], data["density"], data["scale"], data["rotation"]], axis=1
         )
-        self._density = nn.Parameter(
-            torch.tensor(
-                data["density"], dtype=torch.float, device="cuda"
-            ).requires_grad_(True)
+        self._packed = nn.Parameter(
+            torch.tensor(packed, dtype=torch.float, device=self.device).requires_grad_(True)
         )
-        self._scaling = nn.Parameter(
-            torch.tensor(
-                data["scale"], dtype=torch.float, device="cuda"
-            ).requires_grad_(True)
-        )
-        self._rotation = nn.Parameter(
-            torch.tensor(
-                data["rotation"], dtype=torch.float, device="cuda"
-            ).requires_grad_(True)
-        )
-        self.period = nn.Parameter(torch.FloatTensor([2.8]).cuda().requires_grad_(True))
+        if "period" in data:
+            period = torch.tensor(data["period"], dtype=torch.float, device=self.device)
+        else:
+            period = torch.FloatTensor([np.log(2.8)]).to(self.device)
+        self.period = nn.Parameter(period.requires_grad_(True))
         self.scale_bound = data["scale_bound"]
+        self.bump_version()
         self.setup_functions()  # Reset activation functions
 
-    def replace_tensor_to_optimizer(self, tensor, name):
-        optimizable_tensors = {}
-        for group in self.optimizer.param_groups:
-            if group["name"] == name:
-                stored_state = self.optimizer.state.get(group["params"][0], None)
-                stored_state["exp_avg"] = torch.zeros_like(tensor)
-                stored_state["exp_avg_sq"] = torch.zeros_like(tensor)
-
-                del self.optimizer.state[group["params"][0]]
-                group["params"][0] = nn.Parameter(tensor.requires_grad_(True))
-                self.optimizer.state[group["params"][0]] = stored_state
-
-                optimizable_tensors[group["name"]] = group["params"][0]
-        return optimizable_tensors
+    @property
+    def plane_resolution_scale(self):
+        return getattr(self._deformation.deformation_net.grid, "resolution_scale", 1.0)
+
+    def resample_planes(self, scale):
+        """Resample the HexPlane planes to scale x their full resolution, together with
+        their Adam moments in the grid param group."""
+        pairs = self._deformation.deformation_net.grid.resample(scale)
+        if self.optimizer is not None:
+            new_planes = {id(old): new for old, new in pairs}
+            for group in self.optimizer.param_groups:
+                if group["name"] != "grid":
+                    continue
+                for i, param in enumerate(group["params"]):
+                    new = new_planes.get(id(param))
+                    if new is None:
+                        continue
+                    if isinstance(self.optimizer, SparseRowAdam):
+                        self.optimizer.catch_up_rows(param)
+                    stored_state = self.optimizer.state.pop(param, None)
+                    if stored_state is not None:
+                        stored_state.pop("last_step", None)
+                        stored_state["exp_avg"] = resample_plane(stored_state["exp_avg"], new.shape[2:])
+                        stored_state["exp_avg_sq"] = resample_plane(stored_state["exp_avg_sq"], new.shape[2:])
+                        self.optimizer.state[new] = stored_state
+                    group["params"][i] = new
+        self.bump_version()
 
-    def _prune_optimizer(self, mask):
-        optimizable_tensors = {}
+    def replace_tensor_to_optimizer(self, tensor, name):
+        """Overwrite the columns of one attribute in _packed and reset their Adam moments."""
+        columns = PACKED_COLUMNS[name]
+        with torch.no_grad():
+            self._packed[:, columns] = tensor
+        stored_state = self.optimizer.state.get(self._packed, None)
+        if stored_state:
+            stored_state["exp_avg"][:, columns] = 0
+            stored_state["exp_avg_sq"][:, columns] = 0
+        self.bump_version()
+        return {name: getattr(self, "_" + name)}
+
+    def _point_tensors(self):
+        """Per-Gaussian parameters, their optimizer state and the densification statistics."""
+        tensors = {}
+        tensors["packed"] = self._packed
+        state = self.optimizer.state.get(self._packed, None)
+        for key in PACKED_STATE:
+            if state and key in state:
+                tensors[f"packed.{key}"] = state[key]
+        for name, attr in POINT_STATS.items():
+            tensors[name] = getattr(self, attr)
+        return tensors
+
+    def _sync_storage(self):
+        """Copy per-Gaussian tensors replaced since the last densification (load_ply,
+        the first optimizer step, reset_density, ...) into the storage."""
+        tensors = self._point_tensors()
+        if self.storage.size != tensors["packed"].shape[0]:
+            self.storage = RowStorage()
+            self._published = {}
+        for name in self.storage.names():
+            if name not in tensors:
+                self.storage.discard(name)
+        for name, tensor in tensors.items():
+            if self._published.get(name) is not tensor:
+                self.storage.set(name, tensor.detach())
+
+    def _publish_storage(self):
+        """Point the parameters, optimizer state and statistics at the storage rows."""
         for group in self.optimizer.param_groups:
-            if len(group["params"]) > 1:
+            if group["params"][0] is not self._packed:
                 continue
-            if group["name"]=='period':continue
-            stored_state = self.optimizer.state.get(group["params"][0], None)
-            if stored_state is not None:
-                stored_state["exp_avg"] = stored_state["exp_avg"][mask]
-                stored_state["exp_avg_sq"] = stored_state["exp_avg_sq"][mask]
-
-                del self.optimizer.state[group["params"][0]]
-                group["params"][0] = nn.Parameter(
-                    (group["params"][0][mask].requires_grad_(True))
-                )
+            stored_state = self.optimizer.state.pop(self._packed, None)
+            group["params"][0] = nn.Parameter(self.storage["packed"])
+            if stored_state:
+                for key in PACKED_STATE:
+                    if key in stored_state:
+                        stored_state[key] = self.storage[f"packed.{key}"]
                 self.optimizer.state[group["params"][0]] = stored_state
+            self._packed = group["params"][0]
+        for name, attr in POINT_STATS.items():
+            setattr(self, attr, self.storage[name])
+        self._published = self._point_tensors()
+
+    def sort_by_morton(self):
+        """Reorder the Gaussians by the Morton code of their centers, so that Gaussians
+        close in space are close in memory for the HexPlane lookups and the MLP. All
+        per-Gaussian tensors are permuted together in the storage, Adam state included."""
+        if self._packed.shape[0] == 0:
+            return
+        self._sync_storage()
+        self.storage.permute(morton_order(self.get_xyz.detach()))
+        self._publish_storage()
+        self.bump_version()
 
-                optimizable_tensors[group["name"]] = group["params"][0]
-            else:
-                group["params"][0] = nn.Parameter(
-                    group["params"][0][mask].requires_grad_(True)
-                )
-                optimizable_tensors[group["name"]] = group["params"][0]
-        return optimizable_tensors
+    def _prune_optimizer(self, mask):
+        """Keep the Gaussians where mask is True, in place in the storage."""
+        self._sync_storage()
+        self.storage.remove(~mask)
+        self._publish_storage()
+        return {"packed": self._packed}
 
     def prune_points(self, mask):
         valid_points_mask = ~mask
-        optimizable_tensors = self._prune_optimizer(valid_points_mask)
-
-        self._xyz = optimizable_tensors["xyz"]
-        self._density = optimizable_tensors["density"]
-        self._scaling = optimizable_tensors["scaling"]
-        self._rotation = optimizable_tensors["rotation"]
-
-        self.xyz_gradient_accum = self.xyz_gradient_accum[valid_points_mask]
-
-        self.denom = self.denom[valid_points_mask]
-        self.max_radii2D = self.max_radii2D[valid_points_mask]
-
-        self._deformation_accum = self._deformation_accum[valid_points_mask]
-        self._deformation_table = self._deformation_table[valid_points_mask]
+        self._prune_optimizer(valid_points_mask)
+        self.bump_version()
 
     def cat_tensors_to_optimizer(self, tensors_dict):
-        optimizable_tensors = {}
-        for group in self.optimizer.param_groups:
-            if len(group["params"])>1:continue
-            if group["name"]=='period':continue
-            assert len(group["params"]) == 1
-            extension_tensor = tensors_dict[group["name"]]
-            stored_state = self.optimizer.state.get(group["params"][0], None)
-            if stored_state is not None:
-                stored_state["exp_avg"] = torch.cat(
-                    (stored_state["exp_avg"], torch.zeros_like(extension_tensor)), dim=0
-                )
-                stored_state["exp_avg_sq"] = torch.cat(
-                    (stored_state["exp_avg_sq"], torch.zeros_like(extension_tensor)),
-                    dim=0,
-                )
-
-                del self.optimizer.state[group["params"][0]]
-                group["params"][0] = nn.Parameter(
-                    torch.cat(
-                        (group["params"][0], extension_tensor), dim=0
-                    ).requires_grad_(True)
-                )
-                self.optimizer.state[group["params"][0]] = stored_state
-
-                optimizable_tensors[group["name"]] = group["params"][0]
-            else:
-                group["params"][0] = nn.Parameter(
-                    torch.cat(
-                        (group["params"][0], extension_tensor), dim=0
-                    ).requires_grad_(True)
-                )
-                optimizable_tensors[group["name"]] = group["params"][0]
-
-        return optimizable_tensors
+        """Append Gaussians to the storage, by "packed" or POINT_STATS name. Adam
+        moments and attributes not in tensors_dict start at zero."""
+        self._sync_storage()
+        self.storage.append(tensors_dict)
+        self._publish_storage()
+        return {"packed": self._packed}
 
     def densification_postfix(
         self,
@@ -512,29 +784,22 @@ class GaussianModel:
         new_deformation_table,
     ):
         d = {
-            "xyz": new_xyz,
-            "density": new_densities,
-            "scaling": new_scaling,
-            "rotation": new_rotation,
+            "packed": torch.cat([new_xyz, new_densities, new_scaling, new_rotation], dim=1),
+            "max_radii2D": new_max_radii2D,
+            "deformation_table": new_deformation_table,
         }
 
-        optimizable_tensors = self.cat_tensors_to_optimizer(d)
-        self._xyz = optimizable_tensors["xyz"]
-        self._density = optimizable_tensors["density"]
-        self._scaling = optimizable_tensors["scaling"]
-        self._rotation = optimizable_tensors["rotation"]
-
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.max_radii2D = torch.cat([self.max_radii2D, new_max_radii2D], dim=-1)
-
-        self._deformation_table = torch.cat([self._deformation_table,new_deformation_table],-1)
-        self._deformation_accum = torch.zeros((self.get_xyz.shape[0], 3), device="cuda")
+        self.cat_tensors_to_optimizer(d)
+        self.xyz_gradient_accum.zero_()
+        self.denom.zero_()
+        self._deformation_accum.zero_()
+        self._deformation_steps = 0
+        self.bump_version()
 
     def densify_and_split(self, grads, grad_threshold, densify_scale_threshold, N=2):
         n_init_points = self.get_xyz.shape[0]
         # Extract points that satisfy the gradient condition
-        padded_grad = torch.zeros((n_init_points), device="cuda")
+        padded_grad = torch.zeros((n_init_points), device=self.device)
         padded_grad[: grads.shape[0]] = grads.squeeze()
         selected_pts_mask = torch.where(padded_grad >= grad_threshold, True, False)
         selected_pts_mask = torch.logical_and(
@@ -543,7 +808,7 @@ class GaussianModel:
         )
 
         stds = self.get_scaling[selected_pts_mask].repeat(N, 1)
-        means = torch.zeros((stds.size(0), 3), device="cuda")
+        means = torch.zeros((stds.size(0), 3), device=self.device)
         samples = torch.normal(mean=means, std=stds)
         rots = build_rotation(self._rotation[selected_pts_mask]).repeat(N, 1, 1)
         new_xyz = torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + self.get_xyz[
@@ -572,7 +837,7 @@ class GaussianModel:
         prune_filter = torch.cat(
             (
                 selected_pts_mask,
-                torch.zeros(N * selected_pts_mask.sum(), device="cuda", dtype=bool),
+                torch.zeros(N * selected_pts_mask.sum(), device=self.device, dtype=bool),
             )
         )
         self.prune_points(prune_filter)
@@ -613,6 +878,28 @@ class GaussianModel:
     def get_aabb(self):
         return self._deformation.get_aabb
 
+    @property
+    def spatial_index(self):
+        """SpatialIndex over the centers, rebuilt when _packed was replaced since."""
+        if self._spatial_index is None or self._spatial_index_source() is not self._packed:
+            self._spatial_index = SpatialIndex(self.get_xyz)
+            self._spatial_index_source = weakref.ref(self._packed)
+        return self._spatial_index
+
+    def gaussians_in_box(self, bbox, margin=0.0):
+        """Indices of the Gaussians whose center is inside bbox, [2, 3] min and max corners.
+
+        Only the grid cells overlapping bbox are visited. The index is refreshed after
+        densification and pruning; margin should cover how far the centers moved since,
+        about the xyz learning rate per optimizer step taken.
+        """
+        return self.spatial_index.in_box(bbox, self.get_xyz.detach(), margin)
+
+    def gaussians_near(self, points, radius, margin=0.0):
+        """Indices of the Gaussians whose center is within radius of any [M, 3] point,
+        see gaussians_in_box for margin."""
+        return self.spatial_index.near(points, radius, self.get_xyz.detach(), margin)
+
     def densify_and_prune(
         self,
         max_grad,
@@ -623,40 +910,99 @@ class GaussianModel:
         densify_scale_threshold,
         bbox=None,
     ):
+        """Clone, split and prune in one pass.
+
+        Same result as densify_and_clone, densify_and_split and prune_points in turn (split
+        sources removed, clones and split Gaussians appended, then the pruning criteria
+        applied to all), but the masks come from one snapshot of the activated attributes
+        and the storage is updated once. New Gaussians that would be pruned are never
+        added, the others take the rows of removed ones first.
+        """
         grads = self.xyz_gradient_accum / self.denom
         grads[grads.isnan()] = 0.0
 
+        xyz = self.get_xyz
+        density = self.get_density
+        scaling = self.get_scaling
+
+        def prune_criteria(xyz, density, scaling, radii):
+            # Prune gaussians with too small density
+            prune_mask = (density < min_density).squeeze(-1)
+            # Prune gaussians outside the bbox
+            if bbox is not None:
+                bounds = bbox.to(xyz.device)
+                prune_mask_xyz = ((xyz < bounds[0]) | (xyz > bounds[1])).any(dim=-1)
+                prune_mask = prune_mask | prune_mask_xyz
+            if max_screen_size:
+                prune_mask = torch.logical_or(prune_mask, radii > max_screen_size)
+            if max_scale:
+                prune_mask = torch.logical_or(prune_mask, scaling.max(dim=1).values > max_scale)
+            return prune_mask
+
         # Densify Gaussians if Gaussians are fewer than threshold
-        if densify_scale_threshold:
-            if not max_num_gaussians or (
-                max_num_gaussians and grads.shape[0] < max_num_gaussians
-            ):
-                self.densify_and_clone(grads, max_grad, densify_scale_threshold)
-                self.densify_and_split(grads, max_grad, densify_scale_threshold)
-
-        # Prune gaussians with too small density
-        prune_mask = (self.get_density < min_density).squeeze()
-        # Prune gaussians outside the bbox
-        if bbox is not None:
-            xyz = self.get_xyz
-            prune_mask_xyz = (
-                (xyz[:, 0] < bbox[0, 0])
-                | (xyz[:, 0] > bbox[1, 0])
-                | (xyz[:, 1] < bbox[0, 1])
-                | (xyz[:, 1] > bbox[1, 1])
-                | (xyz[:, 2] < bbox[0, 2])
-                | (xyz[:, 2] > bbox[1, 2])
+        densify = bool(densify_scale_threshold) and (
+            not max_num_gaussians or grads.shape[0] < max_num_gaussians
+        )
+        new_rows = None
+        if densify:
+            largest_scale = torch.max(scaling, dim=1).values
+            # Small Gaussians with large gradients are cloned, large ones split in N
+            clone_mask = (torch.norm(grads, dim=-1) >= max_grad) & (largest_scale <= densify_scale_threshold)
+            split_mask = (grads.squeeze(-1) >= max_grad) & (largest_scale > densify_scale_threshold)
+            N = 2
+
+            # Clones and their sources share the density
+            clone_density = self.density_inverse_activation(density[clone_mask] * 0.5)
+            self._density[clone_mask] = clone_density
+            density = density.clone()
+            density[clone_mask] = self.density_activation(clone_density)
+
+            stds = scaling[split_mask].repeat(N, 1)
+            means = torch.zeros((stds.size(0), 3), device=stds.device)
+            samples = torch.normal(mean=means, std=stds)
+            rots = build_rotation(self._rotation[split_mask]).repeat(N, 1, 1)
+            split_xyz = torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + xyz[split_mask].repeat(N, 1)
+            new_rows = {
+                "xyz": torch.cat([self._xyz[clone_mask], split_xyz]),
+                "density": torch.cat([
+                    clone_density,
+                    self.density_inverse_activation(density[split_mask].repeat(N, 1) * (1 / N)),
+                ]),
+                "scaling": torch.cat([
+                    self._scaling[clone_mask],
+                    self.scaling_inverse_activation(scaling[split_mask].repeat(N, 1) / (0.8 * N)),
+                ]),
+                "rotation": torch.cat([self._rotation[clone_mask], self._rotation[split_mask].repeat(N, 1)]),
+                "max_radii2D": torch.cat([self.max_radii2D[clone_mask], self.max_radii2D[split_mask].repeat(N)]),
+                "deformation_table": torch.cat([
+                    self._deformation_table[clone_mask], self._deformation_table[split_mask].repeat(N)
+                ]),
+            }
+            new_pruned = prune_criteria(
+                new_rows["xyz"],
+                self.density_activation(new_rows["density"]),
+                self.scaling_activation(new_rows["scaling"]),
+                new_rows["max_radii2D"],
             )
-
-            prune_mask = prune_mask | prune_mask_xyz
-
-        if max_screen_size:
-            big_points_vs = self.max_radii2D > max_screen_size
-            prune_mask = torch.logical_or(prune_mask, big_points_vs)
-        if max_scale:
-            big_points_ws = self.get_scaling.max(dim=1).values > max_scale
-            prune_mask = torch.logical_or(prune_mask, big_points_ws)
-        self.prune_points(prune_mask)
+            new_rows = {name: value[~new_pruned] for name, value in new_rows.items()}
+            packed = torch.cat([new_rows.pop(name) for name in PACKED_COLUMNS], dim=1)
+            new_rows["packed"] = packed
+
+        remove_mask = prune_criteria(xyz, density, scaling, self.max_radii2D)
+        if densify:
+            remove_mask = remove_mask | split_mask
+        self._sync_storage()
+        if new_rows is None:
+            self.storage.remove(remove_mask)
+        else:
+            self.storage.replace(remove_mask, new_rows)
+        self._publish_storage()
+        if densify:
+            self.xyz_gradient_accum.zero_()
+            self.denom.zero_()
+            self._deformation_accum.zero_()
+            self._deformation_steps = 0
+        self.bump_version()
 
         torch.cuda.empty_cache()
 
@@ -670,8 +1016,15 @@ class GaussianModel:
 
     @torch.no_grad()
     def update_deformation_table(self,threshold):
+        """Mark Gaussians whose mean position offset since the last update stays at or
+        below threshold as static. Static Gaussians are not evaluated again, so they
+        stay static."""
         # print("origin deformation point nums:",self._deformation_table.sum())
-        self._deformation_table = torch.gt(self._deformation_accum.max(dim=-1).values/100,threshold)
+        steps = max(self._deformation_steps, 1)
+        self._deformation_table = torch.gt(self._deformation_accum.max(dim=-1).values/steps,threshold)
+        self._deformation_accum.zero_()
+        self._deformation_steps = 0
+        self.bump_version()
 
     def print_deformation_weight_grad(self):
         for name, weight in self._deformation.named_parameters():
@@ -726,4 +1079,19 @@ class GaussianModel:
         return total
     
     def compute_regulation(self, time_smoothness_weight, l1_time_planes_weight, plane_tv_weight):
-        return plane_tv_weight * self._plane_regulation() + time_smoothness_weight * self._time_regulation() + l1_time_planes_weight * self._l1_regulation()
\ No newline at end of file
+        """plane_tv_weight * _plane_regulation() + time_smoothness_weight * _time_regulation()
+        + l1_time_planes_weight * _l1_regulation(), with a single fused pass per plane."""
+        multi_res_grids = self._deformation.deformation_net.grid.grids
+        if not multi_res_grids:
+            # Hash-grid encoder: no planes to regularize
+            return torch.zeros((), device=self.get_xyz.device)
+        total = 0
+        for grids in multi_res_grids:
+            if len(grids) == 3:
+                continue
+            for grid_id, plane in enumerate(grids):
+                if grid_id in [2, 4, 5]:  # spatiotemporal planes
+                    total += compute_fused_plane_regulation(plane, time_smoothness_weight, l1_time_planes_weight)
+                else:
+                    total += compute_fused_plane_regulation(plane, plane_tv_weight)
+        return total
\ No newline at end of file
@@ -0,0 +1,142 @@
+from typing import Optional, List
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from x2_gaussian.gaussian.hexplane import border_linear_index, normalize_aabb
+
+
+# Spatial-hash primes of Instant-NGP, one per input dimension
+HASH_PRIMES = [1, 2654435761, 805459861, 3674653429]
+
+
+class HashGridField(nn.Module):
+    """Multi-resolution 4D (x, y, z, t) hash-grid encoder in plain PyTorch.
+
+    Drop-in replacement for HexPlaneField: the same constructor arguments, aabb handling
+    and forward(pts, timestamps) -> [N, feat_dim] features. Each level is a table of at
+    most 2^log2_hashmap_size entries, so memory is fixed by the config instead of growing
+    with the plane resolutions. Levels whose dense grid fits in the table are indexed
+    directly, finer ones through the spatial hash. Settings are read from the
+    kplanes_config keys "hash_levels", "hash_features", "log2_hashmap_size" and
+    "hash_base_resolution"; the finest level matches the finest HexPlane resolution.
+    """
+
+    def __init__(
+        self,
+
+        bounds,
+        planeconfig,
+        multires
+    ) -> None:
+        super().__init__()
+        aabb = torch.tensor([[bounds,bounds,bounds],
+                             [-bounds,-bounds,-bounds]])
+        self.aabb = nn.Parameter(aabb, requires_grad=False)
+        self.grid_config = [planeconfig]
+        self.num_levels = planeconfig.get("hash_levels", 16)
+        self.features_per_level = planeconfig.get("hash_features", 2)
+        self.log2_hashmap_size = planeconfig.get("log2_hashmap_size", 19)
+        base_resolution = planeconfig.get("hash_base_resolution", 16)
+
+        # Geometric progression from the base to the finest HexPlane resolution per axis
+        finest = [r * max(multires) for r in planeconfig["resolution"][:3]] + planeconfig["resolution"][3:]
+        coarsest = [max(2, min(base_resolution, r)) for r in finest]
+        self.resolutions = []
+        for level in range(self.num_levels):
+            scale = level / max(self.num_levels - 1, 1)
+            self.resolutions.append([int(round(b * (r / b) ** scale)) for b, r in zip(coarsest, finest)])
+
+        table_size = 2 ** self.log2_hashmap_size
+        self.tables = nn.ParameterList()
+        self.hashed = []
+        for reso in self.resolutions:
+            num_entries = int(np.prod(reso))
+            self.hashed.append(num_entries > table_size)
+            self.tables.append(nn.Parameter(
+                torch.empty(min(num_entries, table_size), self.features_per_level).uniform_(-1e-4, 1e-4)))
+        self.register_buffer("primes", torch.tensor(HASH_PRIMES), persistent=False)
+        # Corner c of a 4D cell takes the upper neighbour along dimension d if bit d is set
+        corners = torch.arange(16)
+        self.register_buffer("corner_bits", torch.stack([(corners >> d) & 1 for d in range(4)], -1), persistent=False)
+        self.feat_dim = self.num_levels * self.features_per_level
+        print("feature_dim:",self.feat_dim)
+
+    @property
+    def grids(self):
+        # No planes to regularize with the HexPlane TV / smoothness losses
+        return []
+
+    @property
+    def get_aabb(self):
+        return self.aabb[0], self.aabb[1]
+    def set_aabb(self,xyz_max, xyz_min):
+        aabb = torch.tensor([
+            xyz_max,
+            xyz_min
+        ],dtype=torch.float32)
+        self.aabb = nn.Parameter(aabb,requires_grad=False)
+        print("Hash Grid: set aabb=",self.aabb)
+
+    def activations_per_point(self):
+        """float32 values kept per point by one forward pass, for peak-memory estimates."""
+        # int64 corner indices (2 floats each), corner weights and gathered features per level
+        return self.num_levels * 16 * (2 + 1 + self.features_per_level) + self.feat_dim
+
+    def get_spatial_features(self, pts: torch.Tensor):
+        """A 4D hash does not factor into time-invariant spatial terms."""
+        return None
+
+    def interpolate_level(self, level: int, pts: torch.Tensor) -> torch.Tensor:
+        """Quadrilinear interpolation of one level at [N, 4] coordinates in [-1, 1]."""
+        reso = self.resolutions[level]
+        table = self.tables[level]
+        # Per dimension: [N, 2] lower/upper cell index and the matching linear weights
+        indices, weights = [], []
+        for d, size in enumerate(reso):
+            idx0, idx1, frac = border_linear_index(pts[:, d], size)
+            indices.append(torch.stack((idx0, idx1), -1))
+            weights.append(torch.stack((1 - frac, frac), -1))
+
+        # Spread [N, 2] per-dimension terms to the 16 cell corners; index_select is much
+        # faster than advanced indexing here
+        def corner(values, d):
+            return values.index_select(1, self.corner_bits[:, d])
+
+        if self.hashed[level]:
+            index = corner(indices[0] * self.primes[0], 0)
+            for d in range(1, 4):
+                index = index ^ corner(indices[d] * self.primes[d], d)
+            index = index % table.shape[0]
+        else:
+            index, stride = 0, 1
+            for d in range(4):
+                index = index + corner(indices[d] * stride, d)
+                stride *= reso[d]
+        weight = corner(weights[0], 0)
+        for d in range(1, 4):
+            weight = weight * corner(weights[d], d)
+        # [N, 16, F] corner features -> [N, F]
+        features = table.index_select(0, index.view(-1)).view(*index.shape, -1)
+        return (features * weight.unsqueeze(-1)).sum(1)
+
+    def get_density(self, pts: torch.Tensor, timestamps: Optional[torch.Tensor] = None,
+                    spatial_features: Optional[List[torch.Tensor]] = None):
+        """Computes and returns the densities."""
+        pts = normalize_aabb(pts, self.aabb)
+        pts = pts.reshape(-1, pts.shape[-1])
+        if timestamps is None:
+            timestamps = torch.zeros_like(pts[:, :1])
+        timestamps = timestamps.reshape(-1, 1).expand(pts.shape[0], 1)
+        pts = torch.cat((pts, timestamps), dim=-1)
+        return torch.cat([self.interpolate_level(level, pts) for level in range(self.num_levels)], -1)
+
+    def forward(self,
+                pts: torch.Tensor,
+                timestamps: Optional[torch.Tensor] = None,
+                spatial_features: Optional[List[torch.Tensor]] = None):
+
+        features = self.get_density(pts, timestamps, spatial_features)
+
+        return features
@@ -45,6 +45,121 @@ def grid_sample_wrapper(grid: torch.Tensor, coords: torch.Tensor, align_corners:
     interp = interp.squeeze()  # [B?, n, feature_dim?]
     return interp
 
+
+def border_linear_index(coords: torch.Tensor, size: int):
+    """Neighbour indices and weight of 1D linear interpolation, matching grid_sample
+    with align_corners=True and border padding."""
+    pos = ((coords + 1.0) * 0.5 * (size - 1)).clamp(0, size - 1)
+    idx0 = pos.detach().floor().long().clamp(max=max(size - 2, 0))
+    idx1 = (idx0 + 1).clamp(max=size - 1)
+    return idx0, idx1, pos - idx0
+
+
+def collapse_time_plane(grid: torch.Tensor, timestamp: torch.Tensor) -> torch.Tensor:
+    """Collapse a [1, C, reso_t, reso] space-time plane to its [1, C, 1, reso] row at one
+    scalar time.
+
+    Sampling the row with grid_sample_wrapper gives the same result as sampling the plane
+    with the time repeated for every point. On a single row the second coordinate is
+    ignored, so any [n, 2] coords whose first column is the spatial coordinate will do.
+    """
+    t0, t1, wt = border_linear_index(timestamp, grid.shape[-2])
+    rows = grid.index_select(2, torch.stack((t0, t1))).to(timestamp.dtype)  # [1, C, 2, reso]
+    return (rows[:, :, 0] * (1 - wt) + rows[:, :, 1] * wt).unsqueeze(2)
+
+
+PLANE_FORMATS = ["fp32", "fp16", "int8"]
+
+
+def plane_format_of(plane: torch.Tensor) -> str:
+    return {torch.float16: "fp16", torch.int8: "int8"}.get(plane.dtype, "fp32")
+
+
+def quantize_plane(plane: torch.Tensor, fmt: str):
+    """Low-precision copy of a [1, C, H, W] plane, returning (data, affine).
+
+    int8 uses a per-channel affine map, with affine [2, 1, C, 1, 1] holding the scale
+    and offset such that plane ~= data * scale + offset. fp16 and fp32 have no affine.
+    """
+    assert fmt in PLANE_FORMATS, f"Unknown plane format {fmt}"
+    plane = plane.detach()
+    if fmt == "fp32":
+        return plane.float(), None
+    if fmt == "fp16":
+        return plane.half(), None
+    low = plane.amin(dim=(0, 2, 3), keepdim=True)
+    high = plane.amax(dim=(0, 2, 3), keepdim=True)
+    scale = (high - low).clamp_min(1e-8) / 255
+    data = (torch.round((plane - low) / scale) - 128).to(torch.int8)
+    return data, torch.stack((scale, low + 128 * scale))
+
+
+def dequantize_plane(data: torch.Tensor, affine: Optional[torch.Tensor] = None) -> torch.Tensor:
+    plane = data.float()
+    if affine is not None:
+        plane = plane * affine[0] + affine[1]
+    return plane
+
+
+def fake_quantize_plane(plane: torch.Tensor, fmt: str) -> torch.Tensor:
+    """Round-trip plane through fmt in the forward pass, with a straight-through gradient."""
+    return plane + (dequantize_plane(*quantize_plane(plane, fmt)) - plane).detach()
+
+
+def grid_sample_planes(planes: Sequence[torch.Tensor], coords: Sequence[torch.Tensor], fuse: bool,
+                       affines: Optional[Sequence[Optional[torch.Tensor]]] = None) -> List[torch.Tensor]:
+    """Sample each [1, C, H, W] plane at its own [n, 2] coords, returning [n, C] features.
+
+    With fuse=True, planes of the same shape are stacked along the batch dimension and
+    sampled with one grid_sample call. Results are identical, but the stacking copies the
+    planes, which only pays off where the per-call overhead dominates (GPU).
+
+    Quantized planes (see quantize_plane) are sampled in the coords dtype. Bilinear
+    weights sum to one, so the per-channel affine is applied to the [n, C] samples
+    instead of the whole plane.
+    """
+    planes = [plane if plane.dtype == coord.dtype else plane.to(coord.dtype) for plane, coord in zip(planes, coords)]
+    interp = _sample_planes(planes, coords, fuse)
+    if affines is not None:
+        interp = [
+            value if affine is None else value * affine[0].view(1, -1) + affine[1].view(1, -1)
+            for value, affine in zip(interp, affines)
+        ]
+    return interp
+
+
+def _sample_planes(planes: Sequence[torch.Tensor], coords: Sequence[torch.Tensor], fuse: bool) -> List[torch.Tensor]:
+    if not fuse:
+        return [
+            grid_sample_wrapper(plane, coord).view(-1, plane.shape[1])
+            for plane, coord in zip(planes, coords)
+        ]
+    groups = {}
+    for i, plane in enumerate(planes):
+        groups.setdefault(tuple(plane.shape), []).append(i)
+    interp = [None] * len(planes)
+    for shape, indices in groups.items():
+        batch = grid_sample_wrapper(
+            torch.cat([planes[i] for i in indices]),
+            torch.stack([coords[i] for i in indices]),
+        ).reshape(len(indices), -1, shape[1])  # [B, n, C]
+        for b, i in enumerate(indices):
+            interp[i] = batch[b]
+    return interp
+
+
+def scale_resolution(reso: Sequence[int], scale: float) -> List[int]:
+    return [max(2, int(round(r * scale))) for r in reso]
+
+
+def resample_plane(plane: torch.Tensor, size: Sequence[int]) -> torch.Tensor:
+    """Bilinearly resample a [1, C, H, W] plane (or its optimizer moments) to size [H', W'].
+
+    align_corners=True keeps the plane corners on the aabb corners, as in grid_sample_wrapper.
+    """
+    return F.interpolate(plane, size=tuple(size), mode="bilinear", align_corners=True)
+
+
 def init_grid_param(
         grid_nd: int,
         in_dim: int,
@@ -76,26 +191,46 @@ def interpolate_ms_features(pts: torch.Tensor,
                             grid_dimensions: int,
                             concat_features: bool,
                             num_levels: Optional[int],
+                            timestamp: Optional[torch.Tensor] = None,
+                            fuse_planes: Optional[bool] = None,
+                            spatial_interp: Optional[List[torch.Tensor]] = None,
+                            ms_affines: Optional[Collection[Sequence[torch.Tensor]]] = None,
                             ) -> torch.Tensor:
+    # With a scalar timestamp, pts only holds the spatial coordinates and the time is
+    # shared by all points, so planes involving time are sampled along a single line.
+    # With spatial_interp (see interpolate_spatial_features), the per-level product of
+    # the time-free planes is given and only the planes involving time are sampled.
+    # ms_affines holds the per-plane int8 scale/offset of quantized grids (see quantize_plane).
+    in_dim = pts.shape[-1] if timestamp is None else pts.shape[-1] + 1
     coo_combs = list(itertools.combinations(
-        range(pts.shape[-1]), grid_dimensions)
+        range(in_dim), grid_dimensions)
     )    # [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
     if num_levels is None:
         num_levels = len(ms_grids)
+    if fuse_planes is None:
+        fuse_planes = pts.is_cuda
+    plane_ids = [
+        ci for ci, coo_comb in enumerate(coo_combs)
+        if spatial_interp is None or in_dim - 1 in coo_comb
+    ]
+    time_lines = [timestamp is not None and in_dim - 1 in coo_combs[ci] for ci in plane_ids]
+    # Plane coordinates are the same at every level, gather them once
+    coords = [
+        pts[..., coo_combs[ci][:1] * 2] if is_line else pts[..., coo_combs[ci]]
+        for ci, is_line in zip(plane_ids, time_lines)
+    ]
     multi_scale_interp = [] if concat_features else 0.
     grid: nn.ParameterList
     for scale_id,  grid in enumerate(ms_grids[:num_levels]):
-        interp_space = 1.
-        for ci, coo_comb in enumerate(coo_combs):
-            # interpolate in plane
-            feature_dim = grid[ci].shape[1]  # shape of grid[ci]: 1, out_dim, *reso     32
-            interp_out_plane = (
-                grid_sample_wrapper(grid[ci], pts[..., coo_comb])
-                .view(-1, feature_dim)
-            )        # torch.Size([50000, 32]) 
-            # compute product over planes
+        planes = [
+            collapse_time_plane(grid[ci], timestamp) if is_line else grid[ci]
+            for ci, is_line in zip(plane_ids, time_lines)
+        ]   # shape of grid[ci]: 1, out_dim, *reso
+        affines = None if ms_affines is None else [ms_affines[scale_id][ci] for ci in plane_ids]
+        interp_space = 1. if spatial_interp is None else spatial_interp[scale_id]
+        for interp_out_plane in grid_sample_planes(planes, coords, fuse_planes, affines):
+            # compute product over planes, torch.Size([50000, 32])
             interp_space = interp_space * interp_out_plane
-        # breakpoint()
         # combine over scales
         if concat_features:
             multi_scale_interp.append(interp_space)
@@ -107,13 +242,41 @@ def interpolate_ms_features(pts: torch.Tensor,
     return multi_scale_interp
 
 
+def interpolate_spatial_features(pts: torch.Tensor,
+                                 ms_grids: Collection[Iterable[nn.Module]],
+                                 grid_dimensions: int,
+                                 num_levels: Optional[int],
+                                 fuse_planes: Optional[bool] = None,
+                                 ms_affines: Optional[Collection[Sequence[torch.Tensor]]] = None,
+                                 ) -> List[torch.Tensor]:
+    """Per level product of the planes that do not involve time, for spatial pts [n, 3]."""
+    coo_combs = list(itertools.combinations(
+        range(pts.shape[-1] + 1), grid_dimensions)
+    )
+    if num_levels is None:
+        num_levels = len(ms_grids)
+    if fuse_planes is None:
+        fuse_planes = pts.is_cuda
+    plane_ids = [ci for ci, coo_comb in enumerate(coo_combs) if pts.shape[-1] not in coo_comb]
+    coords = [pts[..., coo_combs[ci]] for ci in plane_ids]
+    spatial_interp = []
+    for scale_id, grid in enumerate(ms_grids[:num_levels]):
+        affines = None if ms_affines is None else [ms_affines[scale_id][ci] for ci in plane_ids]
+        interp_space = 1.
+        for interp_out_plane in grid_sample_planes([grid[ci] for ci in plane_ids], coords, fuse_planes, affines):
+            interp_space = interp_space * interp_out_plane
+        spatial_interp.append(interp_space)
+    return spatial_interp
+
+
 class HexPlaneField(nn.Module):
     def __init__(
         self,
         
         bounds,
         planeconfig,
-        multires
+        multires,
+        resolution_scale=1.0,
     ) -> None:
         super().__init__()
         aabb = torch.tensor([[bounds,bounds,bounds],
@@ -122,6 +285,9 @@ class HexPlaneField(nn.Module):
         self.grid_config =  [planeconfig]
         self.multiscale_res_multipliers = multires
         self.concat_features = True
+        # Planes start at resolution_scale x their configured resolution, see resample()
+        self.resolution_scale = resolution_scale
+        self.full_resolutions = []
 
         # 1. Init planes
         self.grids = nn.ModuleList()
@@ -133,11 +299,12 @@ class HexPlaneField(nn.Module):
             config["resolution"] = [
                 r * res for r in config["resolution"][:3]
             ] + config["resolution"][3:]
+            self.full_resolutions.append(config["resolution"])
             gp = init_grid_param(
                 grid_nd=config["grid_dimensions"],
                 in_dim=config["input_coordinate_dim"],
                 out_dim=config["output_coordinate_dim"],
-                reso=config["resolution"],
+                reso=scale_resolution(config["resolution"], resolution_scale),
             )
             # shape[1] is out-dim - Concatenate over feature len for each scale
             if self.concat_features:
@@ -147,6 +314,79 @@ class HexPlaneField(nn.Module):
             self.grids.append(gp)
         # print(f"Initialized model grids: {self.grids}")
         print("feature_dim:",self.feat_dim)
+        # Per-plane int8 scale/offset, only filled while the planes are stored as int8
+        self.plane_affines = nn.ModuleList()
+        # Set to "fp16" or "int8" to train with planes rounded through that format
+        self.fake_quant_format = None
+
+    def quantize(self, fmt: str):
+        """Store the planes as fmt ("fp32", "fp16" or "int8") in place.
+
+        Quantized planes are frozen and meant for inference; "fp32" turns them back into
+        trainable planes. Optimizers holding the old planes have to be rebuilt.
+        """
+        affines = []
+        for level, grid in enumerate(self.grids):
+            level_affines = nn.ParameterList()
+            for ci in range(len(grid)):
+                old_affine = self.plane_affines[level][ci] if len(self.plane_affines) else None
+                data, affine = quantize_plane(dequantize_plane(grid[ci], old_affine), fmt)
+                grid[ci] = nn.Parameter(data, requires_grad=fmt == "fp32")
+                if affine is not None:
+                    level_affines.append(nn.Parameter(affine, requires_grad=False))
+            affines.append(level_affines)
+        self.plane_affines = nn.ModuleList(affines if fmt == "int8" else [])
+
+    def resample(self, scale: float):
+        """Bilinearly resample every plane to scale x its configured resolution in place.
+
+        Returns (old, new) plane pairs, so callers can move optimizer state over.
+        """
+        config = self.grid_config[0]
+        coo_combs = list(itertools.combinations(range(config["input_coordinate_dim"]), config["grid_dimensions"]))
+        pairs = []
+        for level, grid in enumerate(self.grids):
+            reso = scale_resolution(self.full_resolutions[level], scale)
+            for ci, coo_comb in enumerate(coo_combs):
+                old = grid[ci]
+                assert old.is_floating_point() and old.dtype != torch.float16, "Cannot resample quantized planes"
+                size = [reso[cc] for cc in coo_comb[::-1]]
+                grid[ci] = nn.Parameter(resample_plane(old.detach(), size), requires_grad=old.requires_grad)
+                pairs.append((old, grid[ci]))
+        self.resolution_scale = scale
+        return pairs
+
+    def quantize_state_dict(self, state_dict, prefix: str, fmt: str):
+        """Rewrite the planes of this field in state_dict as fmt, leaving the module as is."""
+        for level, grid in enumerate(self.grids):
+            for ci in range(len(grid)):
+                key, affine_key = f"{prefix}grids.{level}.{ci}", f"{prefix}plane_affines.{level}.{ci}"
+                plane = dequantize_plane(state_dict[key], state_dict.pop(affine_key, None))
+                state_dict[key], affine = quantize_plane(plane, fmt)
+                if affine is not None:
+                    state_dict[affine_key] = affine
+        return state_dict
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Take on the plane format and resolution of the checkpoint, so compact
+        # deformation.pth files and ones saved mid coarse-to-fine schedule load as is
+        key = f"{prefix}grids.0.0"
+        if key in state_dict and plane_format_of(state_dict[key]) != plane_format_of(self.grids[0][0]):
+            self.quantize(plane_format_of(state_dict[key]))
+        for level, grid in enumerate(self.grids):
+            for ci in range(len(grid)):
+                stored = state_dict.get(f"{prefix}grids.{level}.{ci}")
+                if stored is not None and stored.shape != grid[ci].shape:
+                    grid[ci] = nn.Parameter(grid[ci].new_empty(stored.shape), requires_grad=grid[ci].requires_grad)
+                    self.resolution_scale = grid[0].shape[-1] / self.full_resolutions[level][0]
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def sampling_grids(self):
+        """Planes and int8 affines to sample, rounded through fake_quant_format if set."""
+        if self.fake_quant_format is not None:
+            grids = [[fake_quantize_plane(plane, self.fake_quant_format) for plane in grid] for grid in self.grids]
+            return grids, None
+        return self.grids, self.plane_affines if len(self.plane_affines) else None
     @property
     def get_aabb(self):
         return self.aabb[0], self.aabb[1]
@@ -158,17 +398,44 @@ class HexPlaneField(nn.Module):
         self.aabb = nn.Parameter(aabb,requires_grad=False)
         print("Voxel Plane: set aabb=",self.aabb)
 
-    def get_density(self, pts: torch.Tensor, timestamps: Optional[torch.Tensor] = None):
+    def activations_per_point(self):
+        """float32 values kept per point by one forward pass, for peak-memory estimates."""
+        # Sample coordinates, and per plane the sampled and multiplied features
+        num_planes = len(self.grids[0])
+        return 2 * num_planes + (2 * num_planes + 1) * self.feat_dim
+
+    def get_spatial_features(self, pts: torch.Tensor):
+        """Time-invariant spatial-plane products per level, reusable by get_density."""
+        pts = normalize_aabb(pts, self.aabb)
+        pts = pts.reshape(-1, pts.shape[-1])
+        grids, affines = self.sampling_grids()
+        return interpolate_spatial_features(
+            pts, ms_grids=grids,
+            grid_dimensions=self.grid_config[0]["grid_dimensions"], num_levels=None,
+            ms_affines=affines)
+
+    def get_density(self, pts: torch.Tensor, timestamps: Optional[torch.Tensor] = None,
+                    spatial_features: Optional[List[torch.Tensor]] = None):
         """Computes and returns the densities."""
         # breakpoint()
         pts = normalize_aabb(pts, self.aabb)
-        pts = torch.cat((pts, timestamps), dim=-1)  # [n_rays, n_samples, 4]
+        grid_dimensions = self.grid_config[0]["grid_dimensions"]
+        # A 0-dim timestamp is shared by all points: skip building the [N, 1] time column
+        scalar_time = timestamps is not None and timestamps.dim() == 0
+        if scalar_time and grid_dimensions != 2:
+            timestamps = timestamps.expand(*pts.shape[:-1], 1)
+            scalar_time = False
+        if not scalar_time:
+            pts = torch.cat((pts, timestamps), dim=-1)  # [n_rays, n_samples, 4]
 
         pts = pts.reshape(-1, pts.shape[-1])
+        grids, affines = self.sampling_grids()
         features = interpolate_ms_features(
-            pts, ms_grids=self.grids,  # noqa  
-            grid_dimensions=self.grid_config[0]["grid_dimensions"],
-            concat_features=self.concat_features, num_levels=None)
+            pts, ms_grids=grids,  # noqa  
+            grid_dimensions=grid_dimensions,
+            concat_features=self.concat_features, num_levels=None,
+            timestamp=timestamps if scalar_time else None,
+            spatial_interp=spatial_features, ms_affines=affines)
         if len(features) < 1:
             features = torch.zeros((0, 1)).to(features.device)
 
@@ -177,8 +444,9 @@ class HexPlaneField(nn.Module):
 
     def forward(self,
                 pts: torch.Tensor,
-                timestamps: Optional[torch.Tensor] = None):
+                timestamps: Optional[torch.Tensor] = None,
+                spatial_features: Optional[List[torch.Tensor]] = None):
 
-        features = self.get_density(pts, timestamps)
+        features = self.get_density(pts, timestamps, spatial_features)
 
         return features
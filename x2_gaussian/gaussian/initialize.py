@@ -26,11 +26,20 @@ def initialize_gaussian(gaussians: GaussianModel, args: ModelParams, loaded_iter
         gaussians.load_ply(ply_path)
         print("Loading trained model at iteration {}".format(loaded_iter))
 
-
-        gaussians.load_model(os.path.join(args.model_path,
-                                        "point_cloud",
-                                        "iteration_" + str(loaded_iter),
-                                                   ))
+        model_dir = os.path.join(args.model_path,
+                                 "point_cloud",
+                                 "iteration_" + str(loaded_iter),
+                                 )
+        trajectory_path = osp.join(model_dir, "trajectories.pickle")
+        if osp.exists(osp.join(model_dir, "deformation.pth")):
+            gaussians.load_model(model_dir)
+        else:
+            assert osp.exists(
+                trajectory_path
+            ), f"Cannot find deformation.pth or trajectories.pickle in {model_dir}."
+        # Loaded last, since loading the model drops any trajectory table
+        if osp.exists(trajectory_path):
+            gaussians.load_trajectories(trajectory_path)
     else:
         if args.ply_path == "":
             if osp.exists(osp.join(args.source_path, "meta_data.json")):
@@ -0,0 +1,33 @@
+import numpy as np
+import torch
+from scipy.spatial import cKDTree
+
+try:
+    from simple_knn._C import distCUDA2
+except ImportError:
+    # CUDA extension is not built, only the CPU k-d tree is available
+    distCUDA2 = None
+
+
+def mean_knn_dist2(points: torch.Tensor, k: int = 3) -> torch.Tensor:
+    """Mean squared distance of each [N, 3] point to its k nearest other points.
+
+    The statistic of simple_knn's distCUDA2 (k=3), used to size the initial Gaussians.
+    CUDA tensors go through distCUDA2 when it is built, anything else through
+    cpu_mean_knn_dist2. Returns an [N] float tensor on the device of points.
+    """
+    if distCUDA2 is not None and points.is_cuda and k == 3:
+        return distCUDA2(points.float())
+    return cpu_mean_knn_dist2(points, k)
+
+
+def cpu_mean_knn_dist2(points: torch.Tensor, k: int = 3) -> torch.Tensor:
+    """mean_knn_dist2 with a scipy k-d tree, queried on all CPU cores."""
+    xyz = points.detach().cpu().numpy().astype(np.float64)
+    k = min(k, xyz.shape[0] - 1)
+    if k < 1:
+        return torch.zeros(xyz.shape[0], dtype=torch.float, device=points.device)
+    # Each point is its own nearest neighbour (or tied with a duplicate at distance 0)
+    dist, _ = cKDTree(xyz).query(xyz, k=k + 1, workers=-1)
+    dist2 = (dist[:, 1:] ** 2).mean(axis=1)
+    return torch.from_numpy(dist2).float().to(points.device)
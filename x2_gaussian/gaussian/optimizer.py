@@ -0,0 +1,204 @@
+import math
+
+import torch
+
+
+class SparseRowAdam(torch.optim.Adam):
+    """Adam that updates param groups flagged "sparse_rows" lazily, row by row along dim 2.
+
+    Meant for the HexPlane planes ([1, C, H, W]). With a scalar time, the space-time planes
+    only receive gradient on the two time rows around it, and coarse spatial planes only
+    where Gaussians are. Rows whose gradient is all zero are skipped. Their moments catch
+    up on the missed decay (beta ** k after k skipped steps) the next time they are
+    touched, as in lazy Adam. Unlike dense Adam, skipped rows do not keep moving with
+    their momentum. When more than dense_fraction of the rows are touched, the plane is
+    updated densely. Groups without the flag are updated by torch.optim.Adam.
+    """
+
+    def __init__(self, params, dense_fraction=0.5, **kwargs):
+        super().__init__(params, **kwargs)
+        self.dense_fraction = dense_fraction
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        param_groups = self.param_groups
+        self.param_groups = [group for group in param_groups if not self._custom_group(group)]
+        try:
+            loss = super().step(closure)
+        finally:
+            self.param_groups = param_groups
+        for group in param_groups:
+            if not self._custom_group(group):
+                continue
+            assert group["weight_decay"] == 0 and not group["amsgrad"] and not group["maximize"]
+            for param in group["params"]:
+                if param.grad is not None:
+                    self._custom_update(param, group)
+        return loss
+
+    def _custom_group(self, group):
+        """Whether the group is updated by _custom_update instead of torch.optim.Adam."""
+        return bool(group.get("sparse_rows"))
+
+    def _custom_update(self, param, group):
+        self._sparse_row_update(param, group)
+
+    def _row_state(self, param, dim=2):
+        state = self.state[param]
+        if len(state) == 0:
+            state["step"] = torch.tensor(0.0)
+            state["exp_avg"] = torch.zeros_like(param, memory_format=torch.preserve_format)
+            state["exp_avg_sq"] = torch.zeros_like(param, memory_format=torch.preserve_format)
+        if "last_step" not in state:
+            # Fresh, or state from dense Adam: every row is up to date
+            state["last_step"] = torch.full((param.shape[dim],), int(state["step"]), dtype=torch.long, device=param.device)
+        return state
+
+    def catch_up_rows(self, param):
+        """Apply the decay pending on skipped rows, e.g. before the plane is resampled."""
+        state = self.state.get(param)
+        if not state or "last_step" not in state:
+            return
+        beta1, beta2 = next(group for group in self.param_groups if any(p is param for p in group["params"]))["betas"]
+        skipped = (int(state["step"]) - state["last_step"]).to(param.dtype).view(1, 1, -1, 1)
+        state["exp_avg"].mul_(beta1 ** skipped)
+        state["exp_avg_sq"].mul_(beta2 ** skipped)
+        state["last_step"].fill_(int(state["step"]))
+
+    def _sparse_row_update(self, param, group):
+        state = self._row_state(param)
+        beta1, beta2 = group["betas"]
+        state["step"] += 1
+        step = int(state["step"])
+        # Rows with any nonzero gradient; amax/amin are much faster than count_nonzero here
+        grad = param.grad
+        rows = ((grad.amax(dim=(0, 1, 3)) != 0) | (grad.amin(dim=(0, 1, 3)) != 0)).nonzero().squeeze(1)
+        if rows.numel() == 0:
+            return
+
+        dense = rows.numel() > self.dense_fraction * param.shape[2]
+        if dense:
+            rows = slice(None)
+            exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
+        else:
+            exp_avg = state["exp_avg"].index_select(2, rows)
+            exp_avg_sq = state["exp_avg_sq"].index_select(2, rows)
+            grad = grad.index_select(2, rows)
+        # Decay owed for the steps since each row was last updated
+        skipped = step - 1 - state["last_step"][rows]
+        if skipped.any():
+            skipped = skipped.to(param.dtype).view(1, 1, -1, 1)
+            exp_avg.mul_(beta1 ** skipped)
+            exp_avg_sq.mul_(beta2 ** skipped)
+        exp_avg.lerp_(grad, 1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+        step_size = group["lr"] / (1 - beta1 ** step)
+        denom = (exp_avg_sq.sqrt() / math.sqrt(1 - beta2 ** step)).add_(group["eps"])
+        if dense:
+            param.addcdiv_(exp_avg, denom, value=-step_size)
+        else:
+            param.index_add_(2, rows, exp_avg / denom, alpha=-step_size)
+            state["exp_avg"].index_copy_(2, rows, exp_avg)
+            state["exp_avg_sq"].index_copy_(2, rows, exp_avg_sq)
+        state["last_step"][rows] = step
+
+
+class PackedAdam(SparseRowAdam):
+    """SparseRowAdam that also takes param groups with a "column_lr" tensor.
+
+    Such a group holds one packed [N, C] tensor, e.g. the per-Gaussian xyz, density,
+    scaling and rotation side by side, updated with one learning rate per column in a
+    single pass of tensor ops. Its "lr" entry is not used. Other groups go through
+    torch.optim.Adam, with foreach kernels where available.
+
+    If the group is also flagged "visible_rows", only the rows where the [N] bool mask
+    passed as step(visible=...) is True are updated, e.g. the Gaussians seen by the
+    rendered projection, and the others catch up on the missed decay when next visible,
+    as SparseRowAdam does along the plane rows. Without a mask, rows with any nonzero
+    gradient are updated. Gathering and scattering the rows costs several times a dense
+    pass per row, so above visible_dense_fraction of the rows the group is updated densely.
+    """
+
+    def __init__(self, params, dense_fraction=0.5, visible_dense_fraction=0.15, **kwargs):
+        super().__init__(params, dense_fraction=dense_fraction, **kwargs)
+        self.visible_dense_fraction = visible_dense_fraction
+        self.visible = None
+
+    @torch.no_grad()
+    def step(self, closure=None, visible=None):
+        self.visible = visible
+        try:
+            return super().step(closure)
+        finally:
+            self.visible = None
+
+    def _custom_group(self, group):
+        return "column_lr" in group or super()._custom_group(group)
+
+    def _custom_update(self, param, group):
+        if "column_lr" not in group:
+            return super()._custom_update(param, group)
+        if group.get("visible_rows"):
+            return self._visible_row_update(param, group)
+        state = self.state[param]
+        if len(state) == 0:
+            state["step"] = torch.tensor(0.0)
+            state["exp_avg"] = torch.zeros_like(param, memory_format=torch.preserve_format)
+            state["exp_avg_sq"] = torch.zeros_like(param, memory_format=torch.preserve_format)
+        state["step"] += 1
+        param.sub_(self._column_lr_update(state["exp_avg"], state["exp_avg_sq"], param.grad, group, int(state["step"])))
+
+    def _column_lr_update(self, exp_avg, exp_avg_sq, grad, group, step):
+        """Advance the moments in place and return the step to subtract from the rows."""
+        beta1, beta2 = group["betas"]
+        exp_avg.lerp_(grad, 1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+        # One temporary for the whole update, large temporaries dominate on CPU
+        update = exp_avg_sq.sqrt().div_(math.sqrt(1 - beta2 ** step)).add_(group["eps"])
+        torch.div(exp_avg, update, out=update)
+        return update.mul_(group["column_lr"] / (1 - beta1 ** step))
+
+    def _visible_row_update(self, param, group):
+        state = self._row_state(param, dim=0)
+        beta1, beta2 = group["betas"]
+        state["step"] += 1
+        step = int(state["step"])
+        grad = param.grad
+        if self.visible is not None:
+            assert self.visible.shape == param.shape[:1], "visible must have one entry per row."
+            visible = self.visible
+        else:
+            visible = grad.ne(0).any(dim=1)
+        num_visible = int(visible.sum())
+        if num_visible == 0:
+            return
+
+        if num_visible > self.visible_dense_fraction * param.shape[0]:
+            # Dense update of every row, once the rows skipped before caught up
+            skipped = step - 1 - state["last_step"]
+            if skipped.any():
+                skipped = skipped.to(param.dtype).unsqueeze(1)
+                state["exp_avg"].mul_(beta1 ** skipped)
+                state["exp_avg_sq"].mul_(beta2 ** skipped)
+            param.sub_(self._column_lr_update(state["exp_avg"], state["exp_avg_sq"], grad, group, step))
+            state["last_step"].fill_(step)
+            return
+
+        rows = visible.nonzero().squeeze(1)
+        exp_avg = state["exp_avg"].index_select(0, rows)
+        exp_avg_sq = state["exp_avg_sq"].index_select(0, rows)
+        grad = grad.index_select(0, rows)
+        # This step's decay together with the decay owed for the steps since each row was
+        # last visible, in the same pass
+        decay = (step - state["last_step"][rows]).to(param.dtype).unsqueeze(1)
+        exp_avg.mul_(beta1 ** decay).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2 ** decay).addcmul_(grad, grad, value=1 - beta2)
+
+        update = exp_avg_sq.sqrt().div_(math.sqrt(1 - beta2 ** step)).add_(group["eps"])
+        torch.div(exp_avg, update, out=update)
+        update.mul_(group["column_lr"] / (1 - beta1 ** step))
+        param.index_add_(0, rows, update, alpha=-1)
+        state["exp_avg"].index_copy_(0, rows, exp_avg)
+        state["exp_avg_sq"].index_copy_(0, rows, exp_avg_sq)
+        state["last_step"][rows] = step
@@ -28,6 +28,46 @@ def compute_plane_smoothness(t):
     return torch.square(second_difference).mean()
 
 
+class FusedPlaneRegulation(torch.autograd.Function):
+    """smoothness_weight * compute_plane_smoothness(t) + l1_weight * |1 - t|.mean() in one
+    pass over the plane.
+
+    The gradient is formed in the forward pass from the same second difference, so
+    backward is a single scale. Autograd through the slices of compute_plane_smoothness
+    instead allocates and accumulates a dense gradient per slice.
+    """
+
+    @staticmethod
+    def forward(ctx, t, smoothness_weight, l1_weight):
+        second_difference = torch.add(t[..., 2:, :], t[..., :-2, :]).sub_(t[..., 1:-1, :], alpha=2)
+        count = second_difference.numel()
+        total = torch.square(second_difference).sum() * (smoothness_weight / count)
+        grad = None
+        if ctx.needs_input_grad[0]:
+            # d/dt of the mean squared second difference, scattered back onto the rows
+            second_difference.mul_(2 * smoothness_weight / count)
+            grad = torch.zeros_like(t)
+            grad[..., 2:, :].add_(second_difference)
+            grad[..., 1:-1, :].sub_(second_difference, alpha=2)
+            grad[..., :-2, :].add_(second_difference)
+        if l1_weight:
+            difference = 1 - t
+            total = total + difference.abs().mean() * l1_weight
+            if grad is not None:
+                grad.sub_(difference.sign_(), alpha=l1_weight / t.numel())
+        ctx.save_for_backward(grad)
+        return total
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        grad, = ctx.saved_tensors
+        return grad * grad_output, None, None
+
+
+def compute_fused_plane_regulation(t, smoothness_weight, l1_weight=0.0):
+    return FusedPlaneRegulation.apply(t, float(smoothness_weight), float(l1_weight))
+
+
 class Regularizer():
     def __init__(self, reg_type, initialization):
         self.reg_type = reg_type
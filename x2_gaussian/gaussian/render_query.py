@@ -11,20 +11,63 @@
 import sys
 import torch
 import math
-from xray_gaussian_rasterization_voxelization import (
-    GaussianRasterizationSettings,
-    GaussianRasterizer,
-    GaussianVoxelizationSettings,
-    GaussianVoxelizer,
-)
 import time as timeku
 
 sys.path.append("./")
+try:
+    from xray_gaussian_rasterization_voxelization import (
+        GaussianRasterizationSettings,
+        GaussianRasterizer,
+        GaussianVoxelizationSettings,
+        GaussianVoxelizer,
+    )
+except ImportError:
+    # CUDA extension is not built, only the PyTorch backend is available
+    from x2_gaussian.gaussian.torch_rasterizer import (
+        GaussianRasterizationSettings,
+        GaussianVoxelizationSettings,
+    )
+    GaussianRasterizer = None
+    GaussianVoxelizer = None
+from x2_gaussian.gaussian.torch_rasterizer import (
+    TorchGaussianRasterizer,
+    TorchGaussianVoxelizer,
+)
 from x2_gaussian.gaussian.gaussian_model import GaussianModel
 from x2_gaussian.dataset.cameras import Camera
 from x2_gaussian.arguments import PipelineParams
 
 
+def get_backend(pipe: PipelineParams, device):
+    """
+    Resolve the splatting backend. With "auto" the CUDA kernels are used when they
+    are built and the Gaussians live on a GPU, otherwise the PyTorch reference.
+    """
+    backend = pipe.backend
+    if backend == "auto":
+        if GaussianRasterizer is not None and torch.device(device).type == "cuda":
+            backend = "cuda"
+        else:
+            backend = "torch"
+    if backend == "cuda" and GaussianRasterizer is None:
+        raise ImportError("xray_gaussian_rasterization_voxelization is not installed!")
+    if backend not in ["cuda", "torch"]:
+        raise ValueError(f"Unsupported backend {backend}!")
+    return backend
+
+
+def get_rasterizer(raster_settings, pipe: PipelineParams, device):
+    if get_backend(pipe, device) == "cuda":
+        return GaussianRasterizer(raster_settings=raster_settings)
+    return TorchGaussianRasterizer(raster_settings=raster_settings)
+
+
+def get_voxelizer(voxel_settings, pipe: PipelineParams, device):
+    if get_backend(pipe, device) == "cuda":
+        return GaussianVoxelizer(voxel_settings=voxel_settings)
+    return TorchGaussianVoxelizer(voxel_settings=voxel_settings)
+
+
 def query(
     pc: GaussianModel,
     center,
@@ -52,36 +95,27 @@ def query(
         prefiltered=False,
         debug=pipe.debug,
     )
-    voxelizer = GaussianVoxelizer(voxel_settings=voxel_settings)
+    voxelizer = get_voxelizer(voxel_settings, pipe, pc.get_xyz.device)
 
-    means3D = pc.get_xyz
     density = pc.get_density
-
-    time = torch.tensor(time).to(means3D.device).repeat(means3D.shape[0],1)
+    means3D_final, scales_final, rotations_final = pc.get_deformed(time, stage)
+    scales_final = pc.scaling_activation(scales_final)
+    rotations_final = pc.rotation_activation(rotations_final)
 
     scales = None
     rotations = None
     cov3D_precomp = None
     if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
-    else:
-        # scales = pc.get_scaling
-        # rotations = pc.get_rotation
-        scales = pc._scaling
-        rotations = pc._rotation
-
-    if stage=='coarse':
-        means3D_final, scales_final, rotations_final = means3D, scales, rotations
+        cov3D_precomp = pc.covariance_activation(scales_final, scaling_modifier, rotations_final)
     else:
-        means3D_final, scales_final, rotations_final = pc._deformation(means3D, scales, rotations, density, time)
-    scales_final = pc.scaling_activation(scales_final)
-    rotations_final = pc.rotation_activation(rotations_final)
+        scales = scales_final
+        rotations = rotations_final
 
     vol_pred, radii = voxelizer(
         means3D=means3D_final,
         opacities=density,
-        scales=scales_final,
-        rotations=rotations_final,
+        scales=scales,
+        rotations=rotations,
         cov3D_precomp=cov3D_precomp,
     )
 
@@ -91,21 +125,23 @@ def query(
     }
 
 
-def render(
+def rasterize(
     viewpoint_camera: Camera,
     pc: GaussianModel,
     pipe: PipelineParams,
-    stage='fine',
+    means3D_final,
+    scales_final,
+    rotations_final,
     scaling_modifier=1.0,
 ):
     """
-    Render an X-ray projection with rasterization.
+    Rasterize already deformed and activated Gaussians into one X-ray projection.
     """
 
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
     screenspace_points = (
         torch.zeros_like(
-            pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda"
+            pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device=pc.get_xyz.device
         )
         + 0
     )
@@ -139,46 +175,29 @@ def render(
         debug=pipe.debug,
     )
 
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
+    rasterizer = get_rasterizer(raster_settings, pipe, pc.get_xyz.device)
 
-    means3D = pc.get_xyz
     means2D = screenspace_points
     density = pc.get_density
 
-    time = torch.tensor(viewpoint_camera.time).to(means3D.device).repeat(means3D.shape[0],1)
-
     # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
     # scaling / rotation by the rasterizer.
     scales = None
     rotations = None
     cov3D_precomp = None
     if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
+        cov3D_precomp = pc.covariance_activation(scales_final, scaling_modifier, rotations_final)
     else:
-        # scales = pc.get_scaling
-        # rotations = pc.get_rotation
-        scales = pc._scaling
-        rotations = pc._rotation
-
-    # neg_inf_mask = torch.isinf(scales)
-    # if neg_inf_mask.sum() > 0:
-    #     print('scales inf !!!')
-
-    if stage=='coarse':
-        means3D_final, scales_final, rotations_final = means3D, scales, rotations
-    else:
-        # breakpoint()
-        means3D_final, scales_final, rotations_final = pc._deformation(means3D, scales, rotations, density, time)
-    scales_final = pc.scaling_activation(scales_final)
-    rotations_final = pc.rotation_activation(rotations_final)
+        scales = scales_final
+        rotations = rotations_final
 
     # Rasterize visible Gaussians to image, obtain their radii (on screen).
     rendered_image, radii = rasterizer(
         means3D=means3D_final,
         means2D=means2D,
         opacities=density,
-        scales=scales_final,
-        rotations=rotations_final,
+        scales=scales,
+        rotations=rotations,
         cov3D_precomp=cov3D_precomp,
     )
     # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
@@ -190,7 +209,8 @@ def render(
         "radii": radii,
     }
 
-def render_prior_oneT(
+
+def render(
     viewpoint_camera: Camera,
     pc: GaussianModel,
     pipe: PipelineParams,
@@ -200,59 +220,84 @@ def render_prior_oneT(
     """
     Render an X-ray projection with rasterization.
     """
+    means3D_final, scales_final, rotations_final = pc.get_deformed(viewpoint_camera.time, stage)
+    scales_final = pc.scaling_activation(scales_final)
+    rotations_final = pc.rotation_activation(rotations_final)
 
-    # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = (
-        torch.zeros_like(
-            pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda"
-        )
-        + 0
+    return rasterize(
+        viewpoint_camera,
+        pc,
+        pipe,
+        means3D_final,
+        scales_final,
+        rotations_final,
+        scaling_modifier,
     )
-    try:
-        screenspace_points.retain_grad()
-    except:
-        pass
 
-    # Set up rasterization configuration
-    mode = viewpoint_camera.mode
-    if mode == 0:
-        tanfovx = 1.0
-        tanfovy = 1.0
-    elif mode == 1:
-        tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
-        tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
-    else:
-        raise ValueError("Unsupported mode!")
 
-    raster_settings = GaussianRasterizationSettings(
-        image_height=int(viewpoint_camera.image_height),
-        image_width=int(viewpoint_camera.image_width),
-        tanfovx=tanfovx,
-        tanfovy=tanfovy,
-        scale_modifier=scaling_modifier,
-        viewmatrix=viewpoint_camera.world_view_transform,
-        projmatrix=viewpoint_camera.full_proj_transform,
-        campos=viewpoint_camera.camera_center,
-        prefiltered=False,
-        mode=viewpoint_camera.mode,
-        debug=pipe.debug,
-    )
+def render_batch(
+    cameras,
+    pc: GaussianModel,
+    pipe: PipelineParams,
+    stage='fine',
+    scaling_modifier=1.0,
+):
+    """
+    Render X-ray projections of several cameras. Cameras are grouped by time so the
+    deformation network runs once per unique timestamp and is shared by its views.
+    """
+    groups = {}
+    for idx, viewpoint_camera in enumerate(cameras):
+        groups.setdefault(viewpoint_camera.time, []).append(idx)
+
+    images = [None] * len(cameras)
+    radii = [None] * len(cameras)
+    for time, indices in groups.items():
+        means3D_final, scales_final, rotations_final = pc.get_deformed(time, stage)
+        scales_final = pc.scaling_activation(scales_final)
+        rotations_final = pc.rotation_activation(rotations_final)
+        for idx in indices:
+            render_pkg = rasterize(
+                cameras[idx],
+                pc,
+                pipe,
+                means3D_final,
+                scales_final,
+                rotations_final,
+                scaling_modifier,
+            )
+            images[idx] = render_pkg["render"]
+            radii[idx] = render_pkg["radii"]
+
+    radii = torch.stack(radii, 0)
+    return {
+        "render": torch.stack(images, 0),  # [n_views, 1, H, W]
+        "visibility_filter": radii > 0,
+        "radii": radii,
+    }
 
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
 
+def render_prior_oneT(
+    viewpoint_camera: Camera,
+    pc: GaussianModel,
+    pipe: PipelineParams,
+    stage='fine',
+    scaling_modifier=1.0,
+):
+    """
+    Render an X-ray projection with rasterization.
+    """
     means3D = pc.get_xyz
-    means2D = screenspace_points
-    density = pc.get_density
 
-    time = torch.tensor(viewpoint_camera.time).to(means3D.device).repeat(means3D.shape[0],1)
+    time = torch.tensor(viewpoint_camera.time).to(means3D.device)
 
     period=pc.period
     period = torch.exp(period)
-    range_max=torch.tensor((60.0)).cuda()
+    range_max=torch.tensor((60.0)).to(means3D.device)
     time = time * range_max
     with torch.no_grad():
         num_periods = int(range_max / period)
-        cur_period_num = int(time[0] / period)
+        cur_period_num = int(time / period)
         period_list = list(range(num_periods))
         relative_indices = [i - cur_period_num for i in period_list if i != cur_period_num]
         if 1 in relative_indices:
@@ -263,50 +308,21 @@ def render_prior_oneT(
             breakpoint()
 
     new_time = time + torch.tensor(sampled_offset).to(means3D.device) * period
-    time = new_time / range_max
-
-
-    # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
-    # scaling / rotation by the rasterizer.
-    scales = None
-    rotations = None
-    cov3D_precomp = None
-    if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
-    else:
-        # scales = pc.get_scaling
-        # rotations = pc.get_rotation
-        scales = pc._scaling
-        rotations = pc._rotation
-
-    # neg_inf_mask = torch.isinf(scales)
-    # if neg_inf_mask.sum() > 0:
-    #     print('scales inf !!!')
+    time = (new_time / range_max).reshape(())  # scalar time keeps the HexPlane fast path
 
     if stage=='coarse':
-        means3D_final, scales_final, rotations_final = means3D, scales, rotations
+        means3D_final, scales_final, rotations_final = means3D, pc._scaling, pc._rotation
     else:
-        # breakpoint()
-        means3D_final, scales_final, rotations_final = pc._deformation(means3D, scales, rotations, density, time)
+        means3D_final, scales_final, rotations_final = pc.deform(time)
     scales_final = pc.scaling_activation(scales_final)
     rotations_final = pc.rotation_activation(rotations_final)
 
-    # breakpoint()
-
-    # Rasterize visible Gaussians to image, obtain their radii (on screen).
-    rendered_image, radii = rasterizer(
-        means3D=means3D_final,
-        means2D=means2D,
-        opacities=density,
-        scales=scales_final,
-        rotations=rotations_final,
-        cov3D_precomp=cov3D_precomp,
+    return rasterize(
+        viewpoint_camera,
+        pc,
+        pipe,
+        means3D_final,
+        scales_final,
+        rotations_final,
+        scaling_modifier,
     )
-    # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
-    # They will be excluded from value updates used in the splitting criteria. 
-    return {
-        "render": rendered_image,
-        "viewspace_points": screenspace_points,
-        "visibility_filter": radii > 0,
-        "radii": radii,
-    }
\ No newline at end of file
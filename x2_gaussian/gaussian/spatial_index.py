@@ -0,0 +1,122 @@
+import math
+
+import torch
+
+
+def part1by2(x):
+    """Spread the low 21 bits of x so that two zero bits follow each, for Morton codes."""
+    x = x & 0x1FFFFF
+    x = (x | x << 32) & 0x1F00000000FFFF
+    x = (x | x << 16) & 0x1F0000FF0000FF
+    x = (x | x << 8) & 0x100F00F00F00F00F
+    x = (x | x << 4) & 0x10C30C30C30C30C3
+    x = (x | x << 2) & 0x1249249249249249
+    return x
+
+
+def morton_encode(cells):
+    """Morton (z-order) codes of [N, 3] integer cell coordinates below 2^21."""
+    cells = cells.long()
+    return part1by2(cells[:, 0]) | (part1by2(cells[:, 1]) << 1) | (part1by2(cells[:, 2]) << 2)
+
+
+def morton_order(xyz, bits=10):
+    """Permutation that sorts [N, 3] positions by the Morton code of their cell in a
+    2^bits per axis grid over their bounding box."""
+    lower = xyz.min(dim=0).values
+    extent = (xyz.max(dim=0).values - lower).max().clamp_min(1e-12)
+    cells = ((xyz - lower) / extent * (2**bits - 1)).round().long()
+    return morton_encode(cells).argsort()
+
+
+class SpatialIndex:
+    """Points bucketed into a uniform grid of cubic cells, sorted by the Morton code of
+    their cell.
+
+    order lists the point indices cell by cell and each occupied cell keeps its code,
+    first position in order and number of points, so the points of a cell are found by
+    a binary search over the occupied cells. Box and radius queries visit only the cells
+    they overlap, then test the points in them exactly. The cell size is picked for about
+    points_per_cell points per cell if they filled their bounding box evenly.
+
+    The index is a snapshot of the positions it was built from. Queries test candidates
+    against the positions passed in (the build positions by default); margin widens the
+    visited cells by how far points may have moved since the build.
+    """
+
+    def __init__(self, xyz, points_per_cell=8, max_resolution=1024):
+        xyz = xyz.detach()
+        self.xyz = xyz
+        self.num_points = xyz.shape[0]
+        self.lower = xyz.min(dim=0).values if self.num_points else xyz.new_zeros(3)
+        upper = xyz.max(dim=0).values if self.num_points else xyz.new_ones(3)
+        extent = (upper - self.lower).clamp_min(1e-6)
+        volume = float(torch.prod(extent.clamp_min(float(extent.max()) / max_resolution)))
+        self.cell_size = max(
+            (volume * points_per_cell / max(self.num_points, 1)) ** (1 / 3), float(extent.max()) / max_resolution
+        )
+        self.resolution = torch.ceil((upper - self.lower) / self.cell_size).long().clamp(1, max_resolution)
+
+        codes, self.order = morton_encode(self.cell_of(xyz)).sort()
+        self.cell_codes, self.cell_count = torch.unique_consecutive(codes, return_counts=True)
+        self.cell_start = torch.cumsum(self.cell_count, 0) - self.cell_count
+
+    def cell_of(self, xyz):
+        """[N, 3] cell coordinates of positions, clamped to the grid."""
+        cells = torch.floor((xyz - self.lower) / self.cell_size).long()
+        return torch.minimum(cells.clamp_min(0), self.resolution - 1)
+
+    def _points_in_cells(self, cells):
+        """Point indices in the [K, 3] cells, each cell listed once, and the cell of each."""
+        codes = morton_encode(cells)
+        if len(self.cell_codes) == 0:
+            return self.order, codes[:0]
+        slot = torch.searchsorted(self.cell_codes, codes).clamp_max(len(self.cell_codes) - 1)
+        found = (self.cell_codes[slot] == codes).nonzero().squeeze(1)
+        slot = slot[found]
+        counts = self.cell_count[slot]
+        cell = torch.repeat_interleave(found, counts)
+        offsets = torch.arange(cell.shape[0], device=codes.device) - torch.repeat_interleave(
+            torch.cumsum(counts, 0) - counts, counts
+        )
+        return self.order[torch.repeat_interleave(self.cell_start[slot], counts) + offsets], cell
+
+    def _cell_range(self, lower, upper):
+        """Cells from lower to upper inclusive along each axis, as [K, 3] coordinates."""
+        axes = [torch.arange(int(lo), int(hi) + 1, device=self.order.device) for lo, hi in zip(lower, upper)]
+        return torch.cartesian_prod(*axes).view(-1, 3)
+
+    def in_box(self, bbox, xyz=None, margin=0.0):
+        """Sorted indices of the points inside bbox, [2, 3] min and max corners."""
+        xyz = self.xyz if xyz is None else xyz
+        bbox = torch.as_tensor(bbox, dtype=self.lower.dtype, device=self.lower.device)
+        lower, upper = self.cell_of(torch.stack([bbox[0] - margin, bbox[1] + margin]))
+        if torch.prod(upper - lower + 1) > len(self.cell_codes):
+            # Box covers more cells than are occupied: scan the points, it's cheaper
+            candidates = torch.arange(self.num_points, device=self.order.device)
+        else:
+            candidates, _ = self._points_in_cells(self._cell_range(lower, upper))
+        points = xyz[candidates]
+        inside = ((points >= bbox[0]) & (points <= bbox[1])).all(dim=1)
+        return candidates[inside].sort().values
+
+    def near(self, points, radius, xyz=None, margin=0.0):
+        """Sorted indices of the points within radius of any of the [M, 3] points."""
+        xyz = self.xyz if xyz is None else xyz
+        points = points.to(self.lower)
+        reach = math.ceil((radius + margin) / self.cell_size)
+        if points.shape[0] * (2 * reach + 1) ** 3 > self.num_points:
+            # Neighbourhoods cover more cells than there are points: scan in chunks
+            hits = torch.zeros(self.num_points, dtype=torch.bool, device=xyz.device)
+            for chunk in points.split(32):
+                hits |= torch.cdist(xyz, chunk, compute_mode="donot_use_mm_for_euclid_dist").amin(dim=1) <= radius
+            return hits.nonzero().squeeze(1)
+        # (query point, cell) pairs of each point's neighbourhood, inside the grid
+        offsets = self._cell_range([-reach] * 3, [reach] * 3)
+        cells = (self.cell_of(points)[:, None, :] + offsets[None]).view(-1, 3)
+        query = torch.arange(points.shape[0], device=points.device).repeat_interleave(offsets.shape[0])
+        valid = ((cells >= 0) & (cells < self.resolution)).all(dim=1)
+        candidates, pair = self._points_in_cells(cells[valid])
+        query = query[valid][pair]
+        close = (xyz[candidates] - points[query]).norm(dim=1) <= radius
+        return torch.unique(candidates[close])
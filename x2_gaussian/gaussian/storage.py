@@ -0,0 +1,124 @@
+import torch
+
+
+class RowStorage:
+    """Per-Gaussian tensors kept as the leading rows of preallocated buffers.
+
+    All tensors share their first dimension (one row per Gaussian) and live in rows
+    [0, size) of a buffer with room for capacity rows. Appending writes into the spare
+    rows and only reallocates when they run out, growing the capacity by growth, so
+    repeated densification costs amortized O(new rows) instead of a torch.cat of every
+    tensor. Removing rows moves live rows from the tail into the holes, O(removed rows),
+    which keeps the live rows contiguous but does not keep their order. Once fewer than
+    shrink_threshold of the capacity is live, the buffers are compacted.
+    """
+
+    def __init__(self, growth=2.0, shrink_threshold=0.25):
+        self.growth = growth
+        self.shrink_threshold = shrink_threshold
+        self.buffers = {}
+        self.size = 0
+        self.num_reallocations = 0
+
+    @property
+    def capacity(self):
+        return next(iter(self.buffers.values())).shape[0] if self.buffers else 0
+
+    def __contains__(self, name):
+        return name in self.buffers
+
+    def __getitem__(self, name):
+        """Live rows of a buffer, a view that shares its memory."""
+        return self.buffers[name][: self.size]
+
+    def names(self):
+        return list(self.buffers.keys())
+
+    @torch.no_grad()
+    def set(self, name, tensor):
+        """Copy a [size, ...] tensor into the buffer of name, allocating it if needed."""
+        if not self.buffers:
+            self.size = tensor.shape[0]
+        assert tensor.shape[0] == self.size, f"{name} has {tensor.shape[0]} rows, expected {self.size}."
+        buffer = self.buffers.get(name)
+        if (buffer is None or buffer.shape[1:] != tensor.shape[1:] or buffer.dtype != tensor.dtype
+                or buffer.device != tensor.device):
+            buffer = tensor.new_empty((max(self.capacity, self.size),) + tensor.shape[1:])
+            self.buffers[name] = buffer
+        if buffer[: self.size].data_ptr() != tensor.data_ptr():
+            buffer[: self.size] = tensor
+        return self[name]
+
+    def discard(self, name):
+        self.buffers.pop(name, None)
+        if not self.buffers:
+            self.size = 0
+
+    @torch.no_grad()
+    def append(self, rows):
+        """Append the [k, ...] tensors in rows by name; buffers not in rows get zeros."""
+        num_new = next(iter(rows.values())).shape[0]
+        size = self.size + num_new
+        if size > self.capacity:
+            self._reallocate(max(size, int(self.capacity * self.growth)))
+        for name, buffer in self.buffers.items():
+            if name in rows:
+                buffer[self.size : size] = rows[name]
+            else:
+                buffer[self.size : size] = 0
+        self.size = size
+
+    @torch.no_grad()
+    def remove(self, mask):
+        """Remove the rows where the [size] bool mask is True."""
+        keep = ~mask
+        size = int(keep.sum())
+        # Live rows past the new size fill the removed rows before it, one for one
+        holes = mask[:size].nonzero(as_tuple=True)[0]
+        movers = keep[size:].nonzero(as_tuple=True)[0] + size
+        if holes.numel() > 0:
+            for buffer in self.buffers.values():
+                buffer[holes] = buffer[movers]
+        self.size = size
+        if size < self.shrink_threshold * self.capacity:
+            self._reallocate(int(size * self.growth))
+
+    @torch.no_grad()
+    def replace(self, mask, rows):
+        """Remove the rows where the [size] bool mask is True and append rows as in
+        append(), in one pass: new rows go into the removed rows first."""
+        holes = mask.nonzero(as_tuple=True)[0]
+        num_new = next(iter(rows.values())).shape[0] if rows else 0
+        num_filled = min(num_new, holes.numel())
+        filled = holes[:num_filled]
+        for name, buffer in self.buffers.items():
+            if name in rows:
+                buffer[filled] = rows[name][:num_filled]
+            else:
+                buffer[filled] = 0
+        if num_new > num_filled:
+            self.append({name: value[num_filled:] for name, value in rows.items()})
+        elif holes.numel() > num_filled:
+            remaining = torch.zeros_like(mask)
+            remaining[holes[num_filled:]] = True
+            self.remove(remaining)
+
+    @torch.no_grad()
+    def permute(self, order):
+        """Reorder the live rows of every buffer, row i taking the current row order[i]."""
+        for buffer in self.buffers.values():
+            buffer[: self.size] = buffer[: self.size].index_select(0, order)
+
+    def shrink_to_fit(self):
+        """Drop the spare rows, e.g. before the tensors are saved."""
+        if self.capacity > self.size:
+            self._reallocate(self.size)
+
+    @torch.no_grad()
+    def _reallocate(self, capacity):
+        capacity = max(capacity, self.size, 1)
+        for name, buffer in self.buffers.items():
+            resized = buffer.new_empty((capacity,) + buffer.shape[1:])
+            resized[: self.size] = buffer[: self.size]
+            self.buffers[name] = resized
+        self.num_reallocations += 1
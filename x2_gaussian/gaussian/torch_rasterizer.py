@@ -0,0 +1,502 @@
+"""
+Pure-PyTorch reference implementation of the X-ray Gaussian rasterizer and voxelizer.
+
+It mirrors the forward pass of the CUDA kernels in
+xray_gaussian_rasterization_voxelization (same culling, EWA projection,
+integration bias, 16x16 pixel tiles and 8x8x8 voxel blocks) and relies on
+autograd for the backward pass, so projections and volumes can be computed
+on machines without CUDA.
+"""
+import math
+from typing import NamedTuple
+
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+# Keep tiling identical to cuda_rasterizer/config.h and cuda_voxelizer/config.h
+BLOCK_X = 16
+BLOCK_Y = 16
+BLOCK3D = 8
+
+
+class GaussianRasterizationSettings(NamedTuple):
+    image_height: int
+    image_width: int
+    tanfovx: float
+    tanfovy: float
+    scale_modifier: float
+    viewmatrix: torch.Tensor
+    projmatrix: torch.Tensor
+    campos: torch.Tensor
+    prefiltered: bool
+    mode: int
+    debug: bool
+
+
+class GaussianVoxelizationSettings(NamedTuple):
+    scale_modifier: float
+    nVoxel_x: int
+    nVoxel_y: int
+    nVoxel_z: int
+    sVoxel_x: float
+    sVoxel_y: float
+    sVoxel_z: float
+    center_x: float
+    center_y: float
+    center_z: float
+    prefiltered: bool
+    debug: bool
+
+
+def quaternion_to_rotation(q):
+    """Rotation matrices [N, 3, 3] from (unnormalized) quaternions [N, 4]."""
+    r, x, y, z = q.unbind(-1)
+    R = torch.stack(
+        [
+            1 - 2 * (y * y + z * z), 2 * (x * y - r * z), 2 * (x * z + r * y),
+            2 * (x * y + r * z), 1 - 2 * (x * x + z * z), 2 * (y * z - r * x),
+            2 * (x * z - r * y), 2 * (y * z + r * x), 1 - 2 * (x * x + y * y),
+        ],
+        dim=-1,
+    )
+    return R.view(-1, 3, 3)
+
+
+def build_covariance_3d(scales, rotations, cov3D_precomp, scale_modifier):
+    """Full 3D covariance matrices [N, 3, 3] in world space."""
+    if cov3D_precomp is not None and cov3D_precomp.numel() > 0:
+        a, b, c, d, e, f = cov3D_precomp.unbind(-1)
+        return torch.stack([a, b, c, b, d, e, c, e, f], dim=-1).view(-1, 3, 3)
+    # Quaternions are not normalized here, same as computeCov3D
+    L = quaternion_to_rotation(rotations) * (scale_modifier * scales)[:, None, :]
+    return L @ L.transpose(1, 2)
+
+
+def run_chunk(fn, *args):
+    """Run fn on a chunk, trading recomputation for memory when autograd is on."""
+    if torch.is_grad_enabled() and any(
+        torch.is_tensor(a) and a.requires_grad for a in args
+    ):
+        return checkpoint(fn, *args, use_reentrant=False)
+    return fn(*args)
+
+
+def expand_tiles(rect_min, rect_max):
+    """
+    List all (gaussian, tile) pairs covered by the tile rectangles.
+
+    Args:
+        rect_min: [N, D] first touched tile per axis.
+        rect_max: [N, D] one past the last touched tile per axis.
+
+    Returns:
+        gaussian index [P] and tile coordinates [P, D].
+    """
+    extent = rect_max - rect_min
+    counts = extent.prod(-1)
+    pair_gaussian = torch.repeat_interleave(
+        torch.arange(counts.shape[0], device=counts.device), counts
+    )
+    starts = torch.cumsum(counts, 0) - counts
+    offset = torch.arange(pair_gaussian.shape[0], device=counts.device) - starts[pair_gaussian]
+    tiles = []
+    for axis in range(extent.shape[-1]):
+        axis_extent = extent[pair_gaussian, axis]
+        tiles.append(rect_min[pair_gaussian, axis] + offset % axis_extent)
+        offset = torch.div(offset, axis_extent, rounding_mode="floor")
+    return pair_gaussian, torch.stack(tiles, -1)
+
+
+def _splat_tiles(xy, conic, weight, pair_gaussian, tile_xy, height, width):
+    """Accumulate Gaussians into the pixels of their assigned 16x16 tiles."""
+    xy, conic, weight = xy[pair_gaussian], conic[pair_gaussian], weight[pair_gaussian]
+    ly, lx = torch.meshgrid(
+        torch.arange(BLOCK_Y, device=xy.device),
+        torch.arange(BLOCK_X, device=xy.device),
+        indexing="ij",
+    )
+    pix_x = tile_xy[:, :1] * BLOCK_X + lx.reshape(1, -1)  # [P, 256]
+    pix_y = tile_xy[:, 1:] * BLOCK_Y + ly.reshape(1, -1)
+    dx = xy[:, :1] - pix_x
+    dy = xy[:, 1:] - pix_y
+    power = (
+        -0.5 * (conic[:, :1] * dx * dx + conic[:, 2:] * dy * dy)
+        - conic[:, 1:2] * dx * dy
+    )
+    alpha = weight[:, None] * torch.exp(power.clamp(max=0.0))
+    keep = (power <= 0.0) & (alpha >= 0.00001) & (pix_x < width) & (pix_y < height)
+    alpha = torch.where(keep, alpha, torch.zeros_like(alpha))
+    pix_id = (pix_y * width + pix_x).clamp(max=height * width - 1)
+    image = torch.zeros(height * width, dtype=xy.dtype, device=xy.device)
+    return image.index_add(0, pix_id.flatten(), alpha.flatten())
+
+
+def rasterize_gaussians(
+    means3D,
+    means2D,
+    opacities,
+    scales,
+    rotations,
+    cov3Ds_precomp,
+    raster_settings,
+    gaussian_chunk=65536,
+    pair_chunk=2048,
+):
+    settings = raster_settings
+    device = means3D.device
+    H, W = int(settings.image_height), int(settings.image_width)
+    viewmatrix = settings.viewmatrix.to(device)
+    projmatrix = settings.projmatrix.to(device)
+    focal_x = W / (2.0 * settings.tanfovx)
+    focal_y = H / (2.0 * settings.tanfovy)
+    grid = torch.tensor(
+        [(W + BLOCK_X - 1) // BLOCK_X, (H + BLOCK_Y - 1) // BLOCK_Y], device=device
+    )
+    radii = torch.zeros(means3D.shape[0], dtype=torch.int32, device=device)
+
+    # Near culling
+    means_hom = torch.cat([means3D, torch.ones_like(means3D[:, :1])], -1)
+    p_view = means_hom @ viewmatrix[:, :3]
+    in_frustum = torch.nonzero(p_view[:, 2] > 0.2).squeeze(-1)
+
+    p_view = p_view[in_frustum]
+    p_hom = means_hom[in_frustum] @ projmatrix
+    p_proj = p_hom[:, :2] / (p_hom[:, 3:] + 0.0000001)
+    # means2D only carries the screen-space gradient used for densification
+    p_proj = p_proj + means2D[in_frustum, :2]
+
+    cov3D = build_covariance_3d(
+        scales[in_frustum] if scales.numel() > 0 else None,
+        rotations[in_frustum] if rotations.numel() > 0 else None,
+        cov3Ds_precomp[in_frustum] if cov3Ds_precomp.numel() > 0 else None,
+        settings.scale_modifier,
+    )
+
+    # Jacobian of the (affine approximated) projection, computeCov2D
+    tz = p_view[:, 2]
+    zero = torch.zeros_like(tz)
+    if settings.mode == 0:  # parallel beam
+        J = torch.stack(
+            [
+                torch.full_like(tz, focal_x), zero, zero,
+                zero, torch.full_like(tz, focal_y), zero,
+                zero, zero, torch.ones_like(tz),
+            ],
+            -1,
+        )
+    elif settings.mode == 1:  # cone beam
+        limx = 1.3 * settings.tanfovx
+        limy = 1.3 * settings.tanfovy
+        tx = (p_view[:, 0] / tz).clamp(-limx, limx) * tz
+        ty = (p_view[:, 1] / tz).clamp(-limy, limy) * tz
+        l = torch.sqrt(tx * tx + ty * ty + tz * tz)
+        J = torch.stack(
+            [
+                focal_x / tz, zero, -(focal_x * tx) / (tz * tz),
+                zero, focal_y / tz, -(focal_y * ty) / (tz * tz),
+                tx / l, ty / l, tz / l,
+            ],
+            -1,
+        )
+    else:
+        raise ValueError("Unsupported mode!")
+    T = J.view(-1, 3, 3) @ viewmatrix[:3, :3].T
+    cov = T @ cov3D @ T.transpose(1, 2)
+
+    # Integration bias factor mu
+    a, b, c = cov[:, 0, 0], cov[:, 0, 1], cov[:, 0, 2]
+    d, e, f = cov[:, 1, 1], cov[:, 1, 2], cov[:, 2, 2]
+    det = a * d - b * b
+    valid = det != 0.0
+    det = torch.where(valid, det, torch.ones_like(det))
+    circ = a * d * f + 2 * b * c * e - a * e * e - f * b * b - d * c * c
+    mu_square = 2 * math.pi * circ / det
+    mu = torch.where(
+        mu_square > 0.0,
+        torch.sqrt(mu_square.clamp(min=1e-12)),
+        torch.zeros_like(mu_square),
+    )
+    conic = torch.stack([d / det, -b / det, a / det], -1)
+    point_image = ((p_proj + 1.0) * torch.tensor([W, H], device=device) - 1.0) * 0.5
+
+    # Screen-space extent and touched tiles, getRect
+    with torch.no_grad():
+        mid = 0.5 * (a + d)
+        lambda1 = mid + torch.sqrt((mid * mid - det).clamp(min=0.1))
+        radius = torch.ceil(3.0 * torch.sqrt(lambda1))
+        block = torch.tensor([BLOCK_X, BLOCK_Y], device=device)
+        rect_min = torch.trunc((point_image - radius[:, None]) / block)
+        rect_max = torch.trunc((point_image + radius[:, None] + block - 1) / block)
+        rect_min = torch.minimum(rect_min.long().clamp(min=0), grid)
+        rect_max = torch.minimum(rect_max.long().clamp(min=0), grid)
+        valid = valid & ((rect_max - rect_min).prod(-1) > 0)
+        radii[in_frustum[valid]] = radius[valid].int()
+        visible = torch.nonzero(valid).squeeze(-1)
+
+    weight = opacities[in_frustum, 0] * mu
+    image = torch.zeros(H * W, dtype=means3D.dtype, device=device)
+    for start in range(0, visible.shape[0], gaussian_chunk):
+        ids = visible[start : start + gaussian_chunk]
+        with torch.no_grad():
+            pair_gaussian, pair_tile = expand_tiles(rect_min[ids], rect_max[ids])
+            pair_gaussian = ids[pair_gaussian]
+        for pair_start in range(0, pair_gaussian.shape[0], pair_chunk):
+            image = image + run_chunk(
+                _splat_tiles,
+                point_image,
+                conic,
+                weight,
+                pair_gaussian[pair_start : pair_start + pair_chunk],
+                pair_tile[pair_start : pair_start + pair_chunk],
+                H,
+                W,
+            )
+
+    return image.view(1, H, W), radii
+
+
+class TorchGaussianRasterizer(nn.Module):
+    """Drop-in replacement of GaussianRasterizer that runs on any device."""
+
+    def __init__(self, raster_settings, gaussian_chunk=65536, pair_chunk=2048):
+        super().__init__()
+        self.raster_settings = raster_settings
+        self.gaussian_chunk = gaussian_chunk
+        self.pair_chunk = pair_chunk
+
+    def markVisible(self, positions):
+        # Mark visible points (based on frustum culling for camera) with a boolean
+        with torch.no_grad():
+            viewmatrix = self.raster_settings.viewmatrix.to(positions.device)
+            p_view = positions @ viewmatrix[:3, :3] + viewmatrix[3, :3]
+        return p_view[:, 2] > 0.2
+
+    def forward(
+        self,
+        means3D,
+        means2D,
+        opacities,
+        scales=None,
+        rotations=None,
+        cov3D_precomp=None,
+    ):
+        if ((scales is None or rotations is None) and cov3D_precomp is None) or (
+            (scales is not None or rotations is not None) and cov3D_precomp is not None
+        ):
+            raise Exception(
+                "Please provide exactly one of either scale/rotation pair or precomputed 3D covariance!"
+            )
+
+        if scales is None:
+            scales = torch.Tensor([])
+        if rotations is None:
+            rotations = torch.Tensor([])
+        if cov3D_precomp is None:
+            cov3D_precomp = torch.Tensor([])
+
+        return rasterize_gaussians(
+            means3D,
+            means2D,
+            opacities,
+            scales,
+            rotations,
+            cov3D_precomp,
+            self.raster_settings,
+            self.gaussian_chunk,
+            self.pair_chunk,
+        )
+
+
+def _splat_blocks(xyz, conic, opacity, pair_gaussian, block_xyz, z_start, nVoxel):
+    """Accumulate Gaussians into the voxels of their assigned 8x8x8 blocks of a slab."""
+    xyz, conic, opacity = xyz[pair_gaussian], conic[pair_gaussian], opacity[pair_gaussian]
+    local = torch.stack(
+        torch.meshgrid(*[torch.arange(BLOCK3D, device=xyz.device)] * 3, indexing="ij"),
+        -1,
+    ).view(1, -1, 3)
+    voxel = block_xyz[:, None, :] * BLOCK3D + local  # [P, 512, 3]
+    # Voxel centers are offset by 0.5 like in the CUDA kernel
+    d = xyz[:, None, :] - (voxel + 0.5)
+    dx, dy, dz = d.unbind(-1)
+    inv_a, inv_b, inv_c, inv_d, inv_e, inv_f = conic[:, None, :].unbind(-1)
+    power = (
+        -0.5 * (inv_a * dx * dx + inv_d * dy * dy + inv_f * dz * dz)
+        - inv_b * dx * dy
+        - inv_c * dx * dz
+        - inv_e * dy * dz
+    )
+    alpha = opacity[:, None] * torch.exp(power.clamp(max=0.0))
+    depth = nVoxel[2]
+    keep = (
+        (power <= 0.0)
+        & (alpha >= 0.000001)
+        & (voxel[..., 0] < nVoxel[0])
+        & (voxel[..., 1] < nVoxel[1])
+        & (voxel[..., 2] < z_start + depth)
+    )
+    alpha = torch.where(keep, alpha, torch.zeros_like(alpha))
+    voxel_id = (
+        (voxel[..., 0] * nVoxel[1] + voxel[..., 1]) * depth + voxel[..., 2] - z_start
+    ).clamp(max=nVoxel[0] * nVoxel[1] * depth - 1)
+    slab = torch.zeros(nVoxel[0] * nVoxel[1] * depth, dtype=xyz.dtype, device=xyz.device)
+    return slab.index_add(0, voxel_id.flatten(), alpha.flatten())
+
+
+def voxelize_gaussians(
+    means3D,
+    opacities,
+    scales,
+    rotations,
+    cov3Ds_precomp,
+    voxel_settings,
+    slab_size=32,
+    pair_chunk=512,
+):
+    """
+    Splat Gaussians into a volume of shape [nVoxel_x, nVoxel_y, nVoxel_z].
+
+    The volume is processed in z-slabs of slab_size voxels. Gaussians are bucketed
+    by the slabs their 3-sigma extent overlaps, so each slab only evaluates its own
+    Gaussians block by block and peak memory scales with the slab, not with the
+    whole volume times N.
+    """
+    settings = voxel_settings
+    device = means3D.device
+    nVoxel = [int(settings.nVoxel_x), int(settings.nVoxel_y), int(settings.nVoxel_z)]
+    sVoxel = torch.tensor(
+        [settings.sVoxel_x, settings.sVoxel_y, settings.sVoxel_z], device=device
+    )
+    center = torch.tensor(
+        [settings.center_x, settings.center_y, settings.center_z], device=device
+    )
+    dVoxel = sVoxel / torch.tensor(nVoxel, device=device)
+    grid = torch.tensor([(n + BLOCK3D - 1) // BLOCK3D for n in nVoxel], device=device)
+    slab_blocks = max(1, slab_size // BLOCK3D)
+    num_slabs = (int(grid[2]) + slab_blocks - 1) // slab_blocks
+    radii = torch.zeros(means3D.shape[0], dtype=torch.int32, device=device)
+
+    # Covariance in voxel space and its inverse (conic)
+    cov3D = build_covariance_3d(
+        scales if scales.numel() > 0 else None,
+        rotations if rotations.numel() > 0 else None,
+        cov3Ds_precomp if cov3Ds_precomp.numel() > 0 else None,
+        settings.scale_modifier,
+    )
+    cov = cov3D / (dVoxel[:, None] * dVoxel[None, :])
+    a, b, c = cov[:, 0, 0], cov[:, 0, 1], cov[:, 0, 2]
+    d, e, f = cov[:, 1, 1], cov[:, 1, 2], cov[:, 2, 2]
+    det = a * d * f + 2 * b * c * e - a * e * e - f * b * b - d * c * c
+    valid = det != 0.0
+    det = torch.where(valid, det, torch.ones_like(det))
+    conic = torch.stack(
+        [
+            (d * f - e * e) / det,
+            (c * e - b * f) / det,
+            (b * e - c * d) / det,
+            (a * f - c * c) / det,
+            (b * c - a * e) / det,
+            (a * d - b * b) / det,
+        ],
+        -1,
+    )
+    point_vol = (means3D - center + sVoxel / 2) / dVoxel
+
+    # 3-sigma extent and touched blocks, getCube
+    with torch.no_grad():
+        if scales.numel() > 0:
+            max_scale = (scales / dVoxel).max(-1).values
+        else:
+            max_scale = torch.linalg.eigvalsh(cov).clamp(min=0).max(-1).values.sqrt()
+        radius = torch.ceil(3.0 * max_scale)
+        valid = valid & (
+            (point_vol >= 0) & (point_vol <= torch.tensor(nVoxel, device=device))
+        ).all(-1)
+        cube_min = torch.trunc((point_vol - radius[:, None]) / BLOCK3D)
+        cube_max = torch.trunc((point_vol + radius[:, None] + BLOCK3D - 1) / BLOCK3D)
+        cube_min = torch.minimum(cube_min.long().clamp(min=0), grid)
+        cube_max = torch.minimum(cube_max.long().clamp(min=0), grid)
+        valid = valid & ((cube_max - cube_min).prod(-1) > 0)
+        radii[valid] = radius[valid].int()
+        visible = torch.nonzero(valid).squeeze(-1)
+
+        # Bucket index: (gaussian, slab) pairs sorted by slab
+        slab_min = cube_min[visible, 2:] // slab_blocks
+        slab_max = (cube_max[visible, 2:] - 1) // slab_blocks + 1
+        pair_gaussian, pair_slab = expand_tiles(slab_min, slab_max)
+        pair_slab = pair_slab[:, 0]
+        order = torch.argsort(pair_slab, stable=True)
+        bucket_gaussian = visible[pair_gaussian[order]]
+        bucket_end = torch.cumsum(torch.bincount(pair_slab, minlength=num_slabs), 0).tolist()
+
+    density = opacities[:, 0]
+    slabs = []
+    for slab_id in range(num_slabs):
+        z_start = slab_id * slab_blocks * BLOCK3D
+        depth = min(slab_blocks * BLOCK3D, nVoxel[2] - z_start)
+        slab = torch.zeros(nVoxel[0] * nVoxel[1] * depth, dtype=means3D.dtype, device=device)
+        with torch.no_grad():
+            ids = bucket_gaussian[(bucket_end[slab_id - 1] if slab_id > 0 else 0) : bucket_end[slab_id]]
+            rect_min = cube_min[ids].clone()
+            rect_max = cube_max[ids].clone()
+            rect_min[:, 2] = rect_min[:, 2].clamp(min=slab_id * slab_blocks)
+            rect_max[:, 2] = rect_max[:, 2].clamp(max=(slab_id + 1) * slab_blocks)
+            pair_gaussian, pair_block = expand_tiles(rect_min, rect_max)
+            pair_gaussian = ids[pair_gaussian]
+        for pair_start in range(0, pair_gaussian.shape[0], pair_chunk):
+            slab = slab + run_chunk(
+                _splat_blocks,
+                point_vol,
+                conic,
+                density,
+                pair_gaussian[pair_start : pair_start + pair_chunk],
+                pair_block[pair_start : pair_start + pair_chunk],
+                z_start,
+                [nVoxel[0], nVoxel[1], depth],
+            )
+        slabs.append(slab.view(nVoxel[0], nVoxel[1], depth))
+
+    return torch.cat(slabs, dim=2), radii
+
+
+class TorchGaussianVoxelizer(nn.Module):
+    """Drop-in replacement of GaussianVoxelizer that runs on any device."""
+
+    def __init__(self, voxel_settings, slab_size=32, pair_chunk=512):
+        super().__init__()
+        self.voxel_settings = voxel_settings
+        self.slab_size = slab_size
+        self.pair_chunk = pair_chunk
+
+    def forward(
+        self,
+        means3D,
+        opacities,
+        scales=None,
+        rotations=None,
+        cov3D_precomp=None,
+    ):
+        if ((scales is None or rotations is None) and cov3D_precomp is None) or (
+            (scales is not None or rotations is not None) and cov3D_precomp is not None
+        ):
+            raise Exception(
+                "Please provide exactly one of either scale/rotation pair or precomputed 3D covariance!"
+            )
+
+        if scales is None:
+            scales = torch.Tensor([])
+        if rotations is None:
+            rotations = torch.Tensor([])
+        if cov3D_precomp is None:
+            cov3D_precomp = torch.Tensor([])
+
+        return voxelize_gaussians(
+            means3D,
+            opacities,
+            scales,
+            rotations,
+            cov3D_precomp,
+            self.voxel_settings,
+            self.slab_size,
+            self.pair_chunk,
+        )
@@ -46,6 +46,34 @@ def get_expon_lr_func(
     return helper
 
 
+def get_expon_lr_table(lr_init, lr_final, lr_delay_steps=0, lr_delay_mult=1.0, max_steps=1000000):
+    """Vectorized get_expon_lr_func: every argument may be an array with one entry per
+    schedule, and the returned function gives all learning rates at a step at once."""
+    lr_init, lr_final, lr_delay_steps, lr_delay_mult, max_steps = np.broadcast_arrays(
+        *[np.asarray(x, dtype=np.float64) for x in (lr_init, lr_final, lr_delay_steps, lr_delay_mult, max_steps)]
+    )
+    disabled = (lr_init == 0.0) & (lr_final == 0.0)
+    # Disabled schedules would take log(0), their rate is zeroed below
+    log_init = np.log(np.where(disabled, 1.0, lr_init))
+    log_final = np.log(np.where(disabled, 1.0, lr_final))
+    delayed = lr_delay_steps > 0
+    delay_steps = np.where(delayed, lr_delay_steps, 1.0)
+
+    def helper(step):
+        if step < 0:
+            return np.zeros_like(lr_init)
+        delay_rate = np.where(
+            delayed,
+            lr_delay_mult + (1 - lr_delay_mult) * np.sin(0.5 * np.pi * np.clip(step / delay_steps, 0, 1)),
+            1.0,
+        )
+        t = np.clip(step / max_steps, 0, 1)
+        log_lerp = np.exp(log_init * (1 - t) + log_final * t)
+        return np.where(disabled, 0.0, delay_rate * log_lerp)
+
+    return helper
+
+
 def build_rotation(r):
     norm = torch.sqrt(
         r[:, 0] * r[:, 0] + r[:, 1] * r[:, 1] + r[:, 2] * r[:, 2] + r[:, 3] * r[:, 3]
@@ -53,7 +81,7 @@ def build_rotation(r):
 
     q = r / norm[:, None]
 
-    R = torch.zeros((q.size(0), 3, 3), device="cuda")
+    R = torch.zeros((q.size(0), 3, 3), device=q.device)
 
     r = q[:, 0]
     x = q[:, 1]
@@ -73,7 +101,7 @@ def build_rotation(r):
 
 
 def build_scaling_rotation(s, r):
-    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device="cuda")
+    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device=s.device)
     R = build_rotation(r)
 
     L[:, 0, 0] = s[:, 0]
@@ -85,7 +113,7 @@ def build_scaling_rotation(s, r):
 
 
 def strip_lowerdiag(L):
-    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device="cuda")
+    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device=L.device)
 
     uncertainty[:, 0] = L[:, 0, 0]
     uncertainty[:, 1] = L[:, 0, 1]